@@ -1,12 +1,19 @@
 import streamlit as st
-import openai
+import functools
 import json
-import re
-import requests
-import os
 import time
-import base64
-from openai import OpenAI
+
+import call_scheduler
+import chat_context
+import image_cache
+import job_manager
+import json_parsing
+import message_length
+import prompt_cache_metrics
+import providers
+import static_assets
+import replicate_async
+from openai_client import get_openai_client
 
 # Initialize Image-Generator session state
 if "img_mode" not in st.session_state:
@@ -19,46 +26,23 @@ if "edit_mode" not in st.session_state:
 # ---- JSON handling functions from content builder ----
 def extract_first_json(text):
     """
-    Improved JSON extraction with better error handling
+    Return the JSON object in a model reply (first element if the whole reply
+    is an array), skipping any prose or code fences around it. Uses a linear
+    scanner instead of a regex, so brace-heavy text cannot make it backtrack.
     """
-    text = text.strip()
-    
-    # Handle array format
-    if text.startswith("["):
-        try:
-            arr = json.loads(text)
-            return arr[0] if arr else {}
-        except json.JSONDecodeError as e:
-            st.error(f"JSON Array Parse Error: {e}")
-            return create_fallback_response()
-    
-    # Handle single object format
-    if text.startswith("{"):
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError as e:
-            st.error(f"JSON Object Parse Error: {e}")
-            return create_fallback_response()
-    
-    # Try to extract JSON from mixed content
     try:
-        # Look for JSON objects in the text
-        json_pattern = r'\{(?:[^{}]|{[^{}]*})*\}'
-        matches = re.findall(json_pattern, text, re.DOTALL)
-        
-        for match in matches:
-            try:
-                return json.loads(match)
-            except json.JSONDecodeError:
-                continue
-        
-        # If no valid JSON found, return fallback
-        return create_fallback_response()
-        
-    except Exception as e:
+        value, _, _ = json_parsing.scan_first_json(text)
+    except json_parsing.JSONScanError as e:
         st.error(f"JSON Extraction Error: {e}")
         return create_fallback_response()
 
+    if isinstance(value, list):
+        value = value[0] if value else {}
+    if not isinstance(value, dict):
+        st.error(f"JSON Extraction Error: expected an object, got {type(value).__name__}")
+        return create_fallback_response()
+    return value
+
 def create_fallback_response():
     """
     Create a safe fallback response when JSON parsing fails
@@ -70,6 +54,10 @@ def create_fallback_response():
         "variant_id": None
     }
 
+def is_fallback_response(output):
+    """True if `output` is the fallback response (compared by body, since length gets recomputed)."""
+    return isinstance(output, dict) and output.get("body") == create_fallback_response()["body"]
+
 def sanitize_json_string(text):
     """
     Sanitize strings to prevent JSON parsing issues
@@ -142,6 +130,151 @@ def validate_and_fix_output(output_dict):
     
     return output_dict
 
+# ---- Structured outputs for campaign content ----
+# Every campaign completion is constrained to this strict JSON schema, so each
+# choice parses on the first json.loads. The repair pipeline (extract_first_json
+# + fallback response) is only a counted safety net.
+CAMPAIGN_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "campaign_message",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "body": {"type": "string"},
+                "placeholders": {"type": "array", "items": {"type": "string"}},
+                "length": {"type": "integer"},
+                "variant_id": {"type": ["string", "null"]},
+            },
+            "required": ["body", "placeholders", "length", "variant_id"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+CAMPAIGN_COMPLETION_ARGS = {
+    "model": "gpt-4o-mini",
+    "max_tokens": 2000,
+    "temperature": 0.7,
+    "response_format": CAMPAIGN_RESPONSE_FORMAT,
+}
+
+def parse_campaign_output(output):
+    """
+    Parse one campaign completion. Schema-constrained output takes the direct
+    json.loads path; anything else (refusals, truncation) falls back to
+    extract_first_json. Each path is counted in st.session_state.parse_stats.
+    """
+    stats = st.session_state.setdefault("parse_stats", {"direct": 0, "repaired": 0, "fallback": 0})
+    output = (output or "").strip()
+
+    try:
+        result = json.loads(output)
+        if isinstance(result, dict):
+            stats["direct"] += 1
+            return validate_and_fix_output(result)
+    except json.JSONDecodeError:
+        pass
+
+    result = extract_first_json(output)
+    if is_fallback_response(result):
+        stats["fallback"] += 1
+        return result
+    stats["repaired"] += 1
+    return validate_and_fix_output(result)
+
+def shorten_campaign_output(client, campaign, output, limit):
+    """One targeted revision asking the model to bring an over-long body under `limit`."""
+    edit_request = {
+        "edit_instruction": (
+            f"Shorten the body to at most {limit} characters (it is {output['length']} now). "
+            "Keep the offer, call to action, tone, language and every {{placeholder}}."
+        ),
+        "base_campaign": campaign,
+        "previous_output": output,
+    }
+    with call_scheduler.slot("openai", CAMPAIGN_COMPLETION_ARGS["model"]):
+        response = client.chat.completions.create(
+            messages=prompt_cache_metrics.build_messages(system_prompt, [
+                {"role": "user", "content": safe_json_dumps(campaign)},
+                {"role": "assistant", "content": safe_json_dumps(output)},
+                {"role": "user", "content": safe_json_dumps(edit_request)},
+            ]),
+            **CAMPAIGN_COMPLETION_ARGS,
+        )
+    prompt_cache_metrics.record_usage(response.usage, "shorten")
+    return parse_campaign_output(response.choices[0].message.content)
+
+def finalize_campaign_output(client, campaign, output):
+    """
+    Recompute length and placeholders from the body. If the body is over the
+    channel/maxLength limit, make exactly one automatic shortening call
+    rather than leaving the user to burn manual edits.
+    """
+    report = message_length.measure(output, campaign["channel"], campaign.get("maxLength"))
+    if not report["over_limit"]:
+        return output
+    try:
+        shortened = shorten_campaign_output(client, campaign, output, report["limit"])
+    except Exception as e:
+        st.warning(f"Automatic shortening failed: {e}")
+        return output
+    if is_fallback_response(shortened):
+        # Refusal or unparseable reply: keep the user's real content
+        return output
+    message_length.measure(shortened, campaign["channel"], campaign.get("maxLength"))
+    if shortened["length"] >= output["length"]:
+        return output
+    return shortened
+
+# Prompt-token budget for the messages sent with each Edit Content request
+CHAT_TOKEN_BUDGET = chat_context.DEFAULT_TOKEN_BUDGET
+
+STREAM_RENDER_INTERVAL = 0.05  # seconds between live body refreshes
+
+def stream_variant_outputs(client, messages, n):
+    """
+    Stream a chat completion with n choices, rendering each variant's `body`
+    as soon as its tokens arrive, and return the full raw text per variant.
+    Final parsing/validation is left to the caller, exactly as for a
+    non-streamed response.
+    """
+    buffers = [""] * n
+    slots = [st.empty() for _ in range(n)]
+    last_render = [0.0] * n
+
+    with call_scheduler.slot("openai", CAMPAIGN_COMPLETION_ARGS["model"]):
+        stream = client.chat.completions.create(
+            messages=prompt_cache_metrics.build_messages(system_prompt, messages),
+            n=n,
+            stream=True,
+            stream_options={"include_usage": True},
+            **CAMPAIGN_COMPLETION_ARGS,
+        )
+        for chunk in stream:
+            if chunk.usage:
+                # Final chunk: usage for the whole request, no choices
+                prompt_cache_metrics.record_usage(chunk.usage, "generate")
+            for choice in chunk.choices:
+                delta = choice.delta.content if choice.delta else None
+                if not delta:
+                    continue
+                idx = choice.index
+                buffers[idx] += delta
+                now = time.monotonic()
+                if now - last_render[idx] < STREAM_RENDER_INTERVAL:
+                    continue
+                last_render[idx] = now
+                body, _ = json_parsing.partial_string_field(buffers[idx], "body")
+                if body is not None:
+                    slots[idx].markdown(f"**Variant {idx+1}** ✍️\n\n{body}")
+
+    # The persistent output section takes over once parsing is done
+    for slot in slots:
+        slot.empty()
+    return buffers
+
 # ---- Image generation functions ----
 FLUX_SYSTEM_PROMPT = """
 You are "Flux Prompt Enhancer." 
@@ -170,234 +303,177 @@ Any deviation from this specification must result in the single-line error above
 
 # Image Gen Helper Functions
 
-def enhance_prompt(raw_prompt: str) -> str:
-    """Call GPT-4o-mini to refine the raw prompt."""
-    try:
-        client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+ENHANCE_MODEL = "gpt-4o-mini"
+ENHANCE_CACHE_TTL = 7 * 24 * 3600  # seconds
+ENHANCE_CACHE_ENTRIES = 1000
+
+@st.cache_data(ttl=ENHANCE_CACHE_TTL, max_entries=ENHANCE_CACHE_ENTRIES, show_spinner=False)
+def _cached_enhancement(system_prompt: str, model: str, raw_prompt: str) -> str:
+    """
+    Process-wide memo of refined prompts. The system prompt and model are part
+    of the cache key, so editing FLUX_SYSTEM_PROMPT invalidates old entries.
+    Exceptions are not cached.
+    """
+    client = get_openai_client()
+    with call_scheduler.slot("openai", model):
         resp = client.chat.completions.create(
-            model="gpt-4o-mini",
+            model=model,
             messages=[
-                {"role": "system", "content": FLUX_SYSTEM_PROMPT},
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": raw_prompt}
             ],
             temperature=0,
             max_tokens=200
         )
-        return resp.choices[0].message.content.strip()
-    except Exception as e:
-        raise Exception(f"OpenAI API error: {str(e)}")
+    prompt_cache_metrics.record_usage(resp.usage, "enhance")
+    return resp.choices[0].message.content.strip()
 
-def generate_flux(prompt: str) -> bytes:
-    """Call Replicate Flux Schnell API and return image bytes."""
-    token = st.secrets["REPLICATE_API_TOKEN"]
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "input": {
-            "prompt": prompt
-        }
-    }
-    
-    api_endpoint = "https://api.replicate.com/v1/models/black-forest-labs/flux-schnell/predictions"
-    
+def enhance_prompt(raw_prompt: str) -> str:
+    """Call GPT-4o-mini to refine the raw prompt (memoized per system prompt + input)."""
     try:
-        resp = requests.post(api_endpoint, headers=headers, json=payload)
-        resp.raise_for_status()
-        prediction = resp.json()
-        prediction_id = prediction["id"]
-        
-        # Poll until completion with timeout
-        max_wait_time = 300  # 5 minutes
-        start_time = time.time()
-        
-        while time.time() - start_time < max_wait_time:
-            status_resp = requests.get(f"https://api.replicate.com/v1/predictions/{prediction_id}", headers=headers)
-            status_resp.raise_for_status()
-            status_data = status_resp.json()
-            
-            if status_data["status"] == "succeeded":
-                outputs = status_data["output"]
-                if isinstance(outputs, list) and len(outputs) > 0:
-                    image_url = outputs[0]
-                elif isinstance(outputs, str):
-                    image_url = outputs
-                else:
-                    raise Exception("No valid output URL found")
-                
-                # Download the image
-                img_resp = requests.get(image_url)
-                img_resp.raise_for_status()
-                return img_resp.content
-                
-            elif status_data["status"] == "failed":
-                error_msg = status_data.get("error", "Unknown error")
-                raise Exception(f"Prediction failed: {error_msg}")
-            
-            time.sleep(2)  # Wait 2 seconds before next poll
-        
-        raise Exception("Generation timed out after 5 minutes")
-        
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Replicate API request error: {str(e)}")
+        return _cached_enhancement(FLUX_SYSTEM_PROMPT, ENHANCE_MODEL, raw_prompt.strip())
     except Exception as e:
-        raise Exception(f"Image generation error: {str(e)}")
-        
-def generate_kontext_max(prompt: str, input_image_uri: str) -> bytes:
-    """Call Replicate Flux Kontext Max API and return image bytes."""
-    token = st.secrets["REPLICATE_API_TOKEN"]
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "input": {
-            "prompt": prompt,
-            "input_image": input_image_uri,
-            "output_format": "jpg",
-        }
-    }
-    api_endpoint = "https://api.replicate.com/v1/models/black-forest-labs/flux-kontext-max/predictions"
+        raise Exception(f"OpenAI API error: {str(e)}")
 
-    try:
-        # kick off the prediction
-        resp = requests.post(api_endpoint, headers=headers, json=payload)
-        resp.raise_for_status()
-        prediction = resp.json()
-        prediction_id = prediction["id"]
-
-        # Poll until completion (same timeout as generate_flux)
-        max_wait_time = 300  # 5 minutes
-        start_time = time.time()
-        while time.time() - start_time < max_wait_time:
-            status_resp = requests.get(
-                f"https://api.replicate.com/v1/predictions/{prediction_id}",
-                headers=headers,
-            )
-            status_resp.raise_for_status()
-            status_data = status_resp.json()
+# Image backends (see the providers package for inputs, caching and errors)
+FLUX = providers.get_provider("flux-schnell")
+KONTEXT = providers.get_provider("kontext-max")
+MULTI_KONTEXT = providers.get_provider("multi-image-kontext")
+
+MAX_VARIATIONS = 8
+
+def parse_seeds(text: str) -> list:
+    """Parse a comma-separated seed list; empty entries mean a random seed."""
+    seeds = []
+    for part in (text or "").split(","):
+        part = part.strip()
+        if not part:
+            seeds.append(None)
+            continue
+        try:
+            seeds.append(int(part))
+        except ValueError:
+            raise Exception(f"Invalid seed '{part}'. Seeds must be whole numbers separated by commas.")
+    return seeds
+
+def generate_flux(prompt: str, seed: int = None, use_cache: bool = False) -> bytes:
+    """
+    Flux Schnell image bytes.
+    With use_cache and a fixed seed, identical requests are served from image_cache.
+    """
+    return FLUX.generate(prompt, seed=seed, use_cache=use_cache)
 
-            if status_data["status"] == "succeeded":
-                outputs = status_data["output"]
-                # handle list or single URL
-                url = outputs[0] if isinstance(outputs, list) else outputs
-                img_resp = requests.get(url)
-                img_resp.raise_for_status()
-                return img_resp.content
+def generate_kontext_max(prompt: str, image_bytes: bytes, mime_type: str = "image/png") -> bytes:
+    """Flux Kontext Max image bytes, styled after one reference image."""
+    return KONTEXT.generate(prompt, image_bytes=image_bytes, mime_type=mime_type)
 
-            if status_data["status"] == "failed":
-                err = status_data.get("error", "Unknown error")
-                raise Exception(f"Prediction failed: {err}")
+#Multi Image Kontext Helper Function
+def generate_multi_image_kontext(prompt: str, image_files, aspect_ratio: str = "match_input_image") -> bytes:
+    """Multi-image Kontext image bytes from up to 4 reference images."""
+    return MULTI_KONTEXT.generate(prompt, image_files=image_files, aspect_ratio=aspect_ratio)
+
+
+# Async variant for fanning out Create-mode variations on replicate_async's
+# shared loop (see run_variations_job); same inputs, caching and errors.
+
+async def generate_flux_async(prompt: str, seed: int = None, use_cache: bool = False) -> bytes:
+    """Async Flux Schnell call returning image bytes (same caching rules as generate_flux)."""
+    return await FLUX.generate_async(prompt, seed=seed, use_cache=use_cache)
+
+
+def render_provider_metrics():
+    """Expander with generation counts, failures and average time per image provider."""
+    stats = providers.metrics()
+    with st.expander("📊 Image provider metrics"):
+        if not stats:
+            st.caption("No images generated in this process yet.")
+            return
+        for name, totals in sorted(stats.items()):
+            st.markdown(f"**{name}**")
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Requests", totals["requests"])
+            col2.metric("Failures", totals["failures"])
+            col3.metric("Avg time", f"{totals['avg_seconds']:.1f}s")
+            col4.metric("Cache hits", totals["cache_hits"])
+        st.caption("Totals since this server process started, across all sessions. Cache hits are not timed.")
+
+
+# ---- Background generation jobs (see job_manager) ----
+# Generation runs on job_manager's pool so a rerun (any widget touch) does not
+# abandon a paid prediction; every rerun re-attaches to the session's job.
+JOB_POLL_INTERVAL = 1.0
+
+def run_variations_job(job, prompt: str, seeds: list, use_cache: bool) -> dict:
+    """Job body for Create-mode variations: submit all at once, record each result as it lands."""
+    coros = [generate_flux_async(prompt, seed, use_cache) for seed in seeds]
+    for i, result in replicate_async.as_completed_sync(coros):
+        job.partial[i] = result
+    images, errors = [], []
+    for i in range(len(seeds)):
+        result = job.partial.get(i)
+        if isinstance(result, Exception) or result is None:
+            errors.append(f"Variation {i+1}: {result}")
+            images.append(None)
+        else:
+            images.append(result)
+    if not any(images):
+        raise Exception("; ".join(errors))
+    return {"images": images, "errors": errors}
 
-            time.sleep(2)
+def run_flux_job(job, prompt: str, seed: int, use_cache: bool) -> bytes:
+    return generate_flux(prompt, seed, use_cache)
 
-        raise Exception("Generation timed out after 5 minutes")
+def run_kontext_job(job, prompt: str, image_bytes: bytes, mime_type: str) -> bytes:
+    return generate_kontext_max(prompt, image_bytes, mime_type)
 
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Replicate API request error: {e}")
-    except Exception as e:
-        raise Exception(f"Image generation error: {e}")
-        
-        
-#Multi Image Kontext Helper Function
-def generate_multi_image_kontext_base64(
-    prompt: str,
-    image_files,
-    aspect_ratio: str = "match_input_image",
-    model_slug: str = "flux-kontext-apps/multi-image-list",
-) -> bytes:
-    """
-    Alternative implementation using base64 data URLs instead of file uploads
-    """
-    if not prompt or not prompt.strip():
-        raise ValueError("Prompt is required.")
-    if not image_files or len(image_files) == 0:
-        raise ValueError("At least one input image is required.")
+def run_combine_job(job, **kwargs) -> bytes:
+    return generate_multi_image_kontext(**kwargs)
 
-    token = st.secrets["REPLICATE_API_TOKEN"]
-    
-    try:
-        # Convert images to base64 data URLs
-        image_data_urls = []
-        
-        for i, f in enumerate(image_files[:4]):
-            try:
-                if hasattr(f, "seek"):
-                    f.seek(0)
-            except Exception:
-                pass
-            
-            # Read file data
-            if hasattr(f, 'read'):
-                file_data = f.read()
-                if hasattr(f, 'seek'):
-                    f.seek(0)
-            else:
-                file_data = f
-            
-            # Get content type
-            content_type = getattr(f, 'type', 'image/png')
-            
-            # Convert to base64 data URL
-            b64_data = base64.b64encode(file_data).decode('utf-8')
-            data_url = f"data:{content_type};base64,{b64_data}"
-            image_data_urls.append(data_url)
-        
-        # Create prediction payload
-        payload = {
-            "input": {
-                "prompt": prompt.strip(),
-                "input_images": image_data_urls,
-                "aspect_ratio": aspect_ratio,
-                "output_format": "png",
-                "safety_tolerance": 2
-            }
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-            "Prefer": "wait"
-        }
-        
-        api_endpoint = f"https://api.replicate.com/v1/models/{model_slug}/predictions"
-        resp = requests.post(api_endpoint, headers=headers, json=payload)
-        resp.raise_for_status()
-        prediction = resp.json()
-        
-        # Handle response (same polling logic as above)
-        prediction_id = prediction["id"]
-        max_wait_time = 300
-        start_time = time.time()
-        
-        while time.time() - start_time < max_wait_time:
-            status_resp = requests.get(
-                f"https://api.replicate.com/v1/predictions/{prediction_id}",
-                headers={"Authorization": f"Bearer {token}"}
-            )
-            status_resp.raise_for_status()
-            status_data = status_resp.json()
-            
-            if status_data["status"] == "succeeded":
-                outputs = status_data["output"]
-                image_url = outputs[0] if isinstance(outputs, list) else outputs
-                img_resp = requests.get(image_url)
-                img_resp.raise_for_status()
-                return img_resp.content
-                
-            elif status_data["status"] == "failed":
-                error_msg = status_data.get("error", "Unknown error")
-                raise Exception(f"Prediction failed: {error_msg}")
-            
-            time.sleep(2)
-        
-        raise Exception("Generation timed out after 5 minutes")
-        
-    except Exception as e:
-        raise Exception(f"Multi-image generation error: {str(e)}")
+def collect_job(job):
+    """Copy a finished job's outcome into the session's result state."""
+    if job.status == "failed":
+        st.session_state.generation_success = False
+        st.session_state.generation_error = job.error
+        st.session_state.generated_image = None
+        st.session_state.generated_images = None
+    elif isinstance(job.result, dict):
+        images = job.result["images"]
+        st.session_state.generated_images = images
+        st.session_state.generated_image = next(img for img in images if img)
+        st.session_state.generation_success = True
+        st.session_state.generation_error = "; ".join(job.result["errors"]) or None
+    else:
+        st.session_state.generated_images = None
+        st.session_state.generated_image = job.result
+        st.session_state.generation_success = True
+        st.session_state.generation_error = None
 
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def render_job_progress(sid: str):
+    """Poll the session's running job; rerun the whole page once it finishes."""
+    job = job_manager.current(sid)
+    if job is None or job.done:
+        st.rerun()
+        return
+    backlog = job_manager.backlog_position(sid)
+    position = call_scheduler.queue_position(sid)
+    if backlog:
+        st.info(f"🕒 Server busy: job {backlog} in line for a worker ({job.elapsed:.0f}s)...")
+    elif position:
+        st.info(f"🕒 Waiting for a free slot: position {position} in the queue ({job.elapsed:.0f}s)...")
+    else:
+        st.info(f"⏳ {job.label}... {job.elapsed:.0f}s. You can keep working; the result will appear here.")
+    if job.total > 1:
+        grid_cols = st.columns(min(job.total, 4))
+        for i in range(job.total):
+            with grid_cols[i % len(grid_cols)]:
+                result = job.partial.get(i)
+                if result is None:
+                    st.info("⏳ Generating...")
+                elif isinstance(result, Exception):
+                    st.error(f"❌ Variation {i+1} failed")
+                else:
+                    st.image(result, caption=f"Variation {i+1}", use_container_width=True)
 
 
 # ---- Page configuration and styling ----
@@ -426,15 +502,14 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # ---- Logo positioned at top left ----
-if os.path.exists("gms_logo.png"):
+logo_uri = static_assets.image_data_uri("gms_logo.png", 250)
+if logo_uri:
     st.markdown(
         """
         <div style='position: fixed; top: 80px; left: 20px; z-index: 999;'>
-            <img src='data:image/png;base64,{}' width='250'>
+            <img src='{}' width='250'>
         </div>
-        """.format(
-            base64.b64encode(open("gms_logo.png", "rb").read()).decode()
-        ), 
+        """.format(logo_uri), 
         unsafe_allow_html=True
     )
 else:
@@ -544,15 +619,14 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # ---- Magic image at bottom right ----
-if os.path.exists("magic.png"):
+magic_uri = static_assets.image_data_uri("magic.png", 100)
+if magic_uri:
     st.markdown(
         """
         <div class='magic-image'>
-            <img src='data:image/png;base64,{}' width='100'>
+            <img src='{}' width='100'>
         </div>
-        """.format(
-            base64.b64encode(open("magic.png", "rb").read()).decode()
-        ), 
+        """.format(magic_uri), 
         unsafe_allow_html=True
     )
 
@@ -639,6 +713,8 @@ if "last_variants" not in st.session_state:
     st.session_state.last_variants = []
 if "selected_variant" not in st.session_state:
     st.session_state.selected_variant = 0
+if "last_campaign" not in st.session_state:
+    st.session_state.last_campaign = None
 
 # Image generation state
 if "refined_prompt" not in st.session_state:
@@ -661,12 +737,12 @@ with tab1:
         tone = st.text_input("Tone", "friendly")
         max_length = st.number_input("Max Length", min_value=1, max_value=1024, value=250)
         variants = st.number_input("Number of Variants", min_value=1, max_value=3, value=1)
+        stream_output = st.checkbox("Stream output as it is written", value=True)
         generate_btn = st.form_submit_button("Generate Content")
 
     # ---- GENERATE CONTENT: starts a NEW session ----
     if generate_btn and prompt:
-        openai_api_key = st.secrets["OPENAI_API_KEY"]
-        client = openai.OpenAI(api_key=openai_api_key)
+        client = get_openai_client()
 
         # Reset chat history to only system prompt (new session)
         st.session_state.chat_history = [{"role": "system", "content": system_prompt}]
@@ -690,49 +766,33 @@ with tab1:
             st.stop()
 
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=st.session_state.chat_history,
-                max_tokens=2000,
-                temperature=0.7,
-                n=int(variants)
-            )
+            if stream_output:
+                outputs = stream_variant_outputs(client, st.session_state.chat_history, int(variants))
+            else:
+                with call_scheduler.slot("openai", CAMPAIGN_COMPLETION_ARGS["model"]):
+                    response = client.chat.completions.create(
+                        messages=prompt_cache_metrics.build_messages(system_prompt, st.session_state.chat_history),
+                        n=int(variants),
+                        **CAMPAIGN_COMPLETION_ARGS,
+                    )
+                prompt_cache_metrics.record_usage(response.usage, "generate")
+                outputs = [choice.message.content or "" for choice in response.choices]
             
-            # Collect variants with robust JSON extraction
+            # Structured outputs parse directly; the repair path is a counted fallback
             variant_list = []
             for i in range(int(variants)):
-                output = response.choices[i].message.content.strip()
+                output = outputs[i].strip()
                 
                 # Debug: Show raw output in expander
                 with st.expander(f"Debug: Raw GPT Output for Variant {i+1}"):
                     st.text(output)
                 
-                try:
-                    # Try direct JSON parsing first
-                    if output.startswith('['):
-                        arr = json.loads(output)
-                        result = arr[i] if i < len(arr) else arr[0] if arr else create_fallback_response()
-                    else:
-                        result = json.loads(output)
-                    
-                    # Validate and fix the result
-                    result = validate_and_fix_output(result)
-                    
-                except json.JSONDecodeError as e:
-                    st.warning(f"JSON parsing failed for variant {i+1}: {e}")
-                    try:
-                        result = extract_first_json(output)
-                        result = validate_and_fix_output(result)
-                    except Exception as e2:
-                        st.error(f"Fallback JSON extraction failed: {e2}")
-                        result = create_fallback_response()
-                
-                except Exception as e:
-                    st.error(f"Unexpected error processing variant {i+1}: {e}")
-                    result = create_fallback_response()
-                
+                result = parse_campaign_output(output)
+                result = finalize_campaign_output(client, input_json, result)
                 variant_list.append(result)
 
+            st.session_state.last_campaign = input_json
+            st.session_state.last_trim_stats = None
             st.session_state.last_variants = variant_list
             st.session_state.selected_variant = 0
             st.session_state.last_output = variant_list[0]
@@ -778,12 +838,36 @@ with tab1:
         display_body = unescape_json_string(output.get("body", ""))
         body = st.text_area("Body", display_body, height=120, key="body_out")
         
+        campaign = st.session_state.get("last_campaign")
+        report = message_length.measure(output, campaign["channel"], campaign.get("maxLength")) if campaign else None
         length = st.text_input("Length", str(output.get("length", "")), key="length_out", disabled=True)
+        if report:
+            if "segments" in report:
+                st.caption(
+                    f"SMS: {report['encoding']}, {report['units']} units, "
+                    f"{report['segments']} segment{'s' if report['segments'] != 1 else ''}"
+                )
+            if report["over_limit"]:
+                st.warning(f"⚠️ Body is {report['length']} characters, over the limit of {report['limit']}.")
         variant_id = st.text_input("Variant ID", output.get("variant_id", ""), key="variant_id_out", disabled=True)
         placeholders = output.get("placeholders", [])
         if placeholders:
             st.markdown(f"**Placeholders:** {', '.join(placeholders)}")
 
+        trim_stats = st.session_state.get("last_trim_stats")
+        if trim_stats:
+            st.caption(
+                f"Last edit sent ~{trim_stats['sent_tokens']} prompt tokens "
+                f"(~{trim_stats['saved_tokens']} saved by trimming history)"
+            )
+
+        parse_stats = st.session_state.get("parse_stats")
+        if parse_stats and (parse_stats["repaired"] or parse_stats["fallback"]):
+            st.caption(
+                f"JSON parsing this session: {parse_stats['direct']} direct, "
+                f"{parse_stats['repaired']} repaired, {parse_stats['fallback']} fallback"
+            )
+
         st.markdown("---")
         st.markdown("#### Follow-up Prompt (for edits)")
         follow_up = st.text_input("Describe your change or revision", key="followup")
@@ -791,48 +875,51 @@ with tab1:
 
         # ---- EDIT CONTENT: continue the existing session ----
         if edit_btn and follow_up:
-            openai_api_key = st.secrets["OPENAI_API_KEY"]
-            client = openai.OpenAI(api_key=openai_api_key)
+            client = get_openai_client()
 
             try:
-                # Get JSON-encoded user message and previous assistant message from chat_history
+                # Base campaign from chat_history; previous output is the latest (possibly edited) result
                 base_user_content = st.session_state.chat_history[1]["content"]
-                previous_output_content = st.session_state.chat_history[2]["content"]
 
                 followup_message = {
                     "role": "user",
                     "content": safe_json_dumps({
                         "edit_instruction": follow_up,
                         "base_campaign": json.loads(base_user_content),
-                        "previous_output": json.loads(previous_output_content)
+                        "previous_output": st.session_state.last_output
                     })
                 }
-                st.session_state.chat_history.append(followup_message)
 
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=st.session_state.chat_history,
-                    max_tokens=2000,
-                    temperature=0.7,
+                # The edit turn embeds everything it needs, so only system + edit are sent
+                messages, trim_stats = chat_context.trim_history(
+                    st.session_state.chat_history + [followup_message], CHAT_TOKEN_BUDGET
                 )
+                st.session_state.last_trim_stats = trim_stats
+
+                messages = prompt_cache_metrics.build_messages(system_prompt, messages)
+                with call_scheduler.slot("openai", CAMPAIGN_COMPLETION_ARGS["model"]):
+                    response = client.chat.completions.create(
+                        messages=messages,
+                        **CAMPAIGN_COMPLETION_ARGS,
+                    )
+                prompt_cache_metrics.record_usage(response.usage, "edit")
                 
-                output_text = response.choices[0].message.content
+                output_text = response.choices[0].message.content or ""
                 
                 # Debug: Show raw edit output
                 with st.expander("Debug: Raw Edit Output"):
                     st.text(output_text)
                 
-                try:
-                    result = extract_first_json(output_text)
-                    result = validate_and_fix_output(result)
-                except Exception as e:
-                    st.error(f"Error parsing edit response: {e}")
-                    result = create_fallback_response()
-
-                # Append assistant response to chat history
-                st.session_state.chat_history.append(
+                result = parse_campaign_output(output_text)
+                if st.session_state.get("last_campaign"):
+                    result = finalize_campaign_output(client, st.session_state.last_campaign, result)
+
+                # Keep chat_history bounded: system + base campaign + latest output
+                st.session_state.chat_history = [
+                    st.session_state.chat_history[0],
+                    st.session_state.chat_history[1],
                     {"role": "assistant", "content": safe_json_dumps(result)}
-                )
+                ]
 
                 st.session_state.last_output = result
                 if st.session_state.last_variants:
@@ -840,7 +927,7 @@ with tab1:
                     st.session_state.last_variants[idx] = result
 
                 # ---- Store RAW INPUT and RAW OUTPUT for always-visible debug ----
-                st.session_state.raw_input_text = safe_json_dumps(st.session_state.chat_history)
+                st.session_state.raw_input_text = safe_json_dumps(messages)
                 st.session_state.raw_output_text = safe_json_dumps(result)
 
                 st.success("Content edited successfully!")
@@ -851,6 +938,8 @@ with tab1:
                 # Show more detailed error information
                 st.error(f"Error details: {str(e)}")
 
+    prompt_cache_metrics.render_panel()
+
 # ---- IMAGE GENERATOR TAB ----
 with tab2:
     st.subheader("Image Generation Details")
@@ -877,6 +966,30 @@ with tab2:
         if editable_prompt != current_refined:
             st.session_state.refined_prompt = editable_prompt
 
+        var_col, seed_col = st.columns([1, 2])
+        with var_col:
+            num_variations = st.number_input(
+                "Variations", min_value=1, max_value=MAX_VARIATIONS, value=1, key="img_variations"
+            )
+        with seed_col:
+            seeds_text = st.text_input(
+                "Seeds (optional)",
+                placeholder="e.g. 42, 7, 1234 (blank = random)",
+                key="img_seeds",
+            )
+
+        use_image_cache = st.checkbox(
+            "Reuse cached images for fixed seeds",
+            key="img_use_cache",
+            help="Same prompt + seed returns the stored image instantly instead of paying for a new prediction.",
+        )
+        if use_image_cache:
+            cache_stats = image_cache.stats()
+            st.caption(
+                f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+                f"{cache_stats['entries']} images ({cache_stats['bytes'] / 1_048_576:.1f} MB)"
+            )
+
     # ---------- INSPIRE (single image to copy style) ----------
     elif mode == "Inspire":
         # show chained output if user clicked “Edit This Image” earlier
@@ -936,9 +1049,11 @@ with tab2:
         if st.button("🔄 Reset All", key="reset_all", use_container_width=True):
             for k in [
                 "image_raw_prompt", "refined_prompt", "chained_image", "edit_mode",
-                "img_prompt_inspire", "img_prompt_combine", "img_mode", "combine_aspect"
+                "img_prompt_inspire", "img_prompt_combine", "img_mode", "combine_aspect",
+                "img_variations", "img_seeds", "img_use_cache"
             ]:
                 st.session_state.pop(k, None)
+            job_manager.cancel(job_manager.session_id())
             st.rerun()
 
         # Refine only in Create
@@ -956,75 +1071,124 @@ with tab2:
                         st.rerun()
 
     # Generate
+    sid = job_manager.session_id()
+    job = job_manager.current(sid)
     with col2:
-        if st.button("🎨 Generate", key="generate_img_btn", use_container_width=True):
-            with st.spinner("🎨 Generating your image..."):
-                try:
-                    if mode == "Create":
-                        prompt_to_send = (
-                            st.session_state.get("refined_prompt", "").strip()
-                            or st.session_state.get("image_raw_prompt", "").strip()
-                        )
-                        if not prompt_to_send:
-                            raise Exception("No prompt available.")
-                        img_bytes = generate_flux(prompt_to_send)
-
-                    elif mode == "Inspire":
-                        if not input_bytes:
-                            raise Exception("Please upload an image first.")
-                        if not st.session_state.get("img_prompt_inspire", "").strip():
-                            raise Exception("Please enter a prompt.")
-                        b64 = base64.b64encode(input_bytes).decode()
-                        uri = f"data:{input_mime};base64,{b64}"
-                        img_bytes = generate_kontext_max(
-                            st.session_state["img_prompt_inspire"].strip(),
-                            uri
+        running = bool(job and not job.done)
+        if st.button("🎨 Generate", key="generate_img_btn", use_container_width=True,
+                     help="Cancels the generation in progress and starts a new one" if running else None):
+            try:
+                total = 1
+                if mode == "Create":
+                    prompt_to_send = (
+                        st.session_state.get("refined_prompt", "").strip()
+                        or st.session_state.get("image_raw_prompt", "").strip()
+                    )
+                    if not prompt_to_send:
+                        raise Exception("No prompt available.")
+                    seeds = parse_seeds(seeds_text)
+                    if int(num_variations) > 1:
+                        total = int(num_variations)
+                        seeds += [None] * (total - len(seeds))
+                        job_fn = functools.partial(
+                            run_variations_job, prompt=prompt_to_send, seeds=seeds[:total], use_cache=use_image_cache
                         )
-
-                    else:  # Combine Images mode
-                        # Build list of files for upload
-                        files_for_upload = []
-                        
-                        # Add chained image first if available
-                        if prefilled:
-                            from io import BytesIO
-                            chained_file = BytesIO(prefilled)
-                            chained_file.name = "chained_image.png"
-                            chained_file.type = "image/png"
-                            files_for_upload.append(chained_file)
-                        
-                        # Add uploaded files
-                        if multi_files:
-                            remaining_slots = max(0, 4 - len(files_for_upload))
-                            files_for_upload.extend(multi_files[:remaining_slots])
-                        
-                        # Validation
-                        if not files_for_upload:
-                            raise Exception("Please upload at least 1 image (or reuse the previous output).")
-                        
-                        if not st.session_state.get("img_prompt_combine", "").strip():
-                            raise Exception("Please enter a prompt.")
-                        
-                        # Generate image using multi-image kontext BASE64 version
-                        img_bytes = generate_multi_image_kontext_base64(
-                            prompt=st.session_state["img_prompt_combine"].strip(),
-                            image_files=files_for_upload,
-                            aspect_ratio=st.session_state.get("combine_aspect", "match_input_image"),
-                            model_slug="flux-kontext-apps/multi-image-list"
+                        label = f"🎨 Generating {total} variations"
+                    else:
+                        job_fn = functools.partial(
+                            run_flux_job, prompt=prompt_to_send, seed=seeds[0] if seeds else None, use_cache=use_image_cache
                         )
+                        label = "🎨 Generating your image"
+
+                elif mode == "Inspire":
+                    if not input_bytes:
+                        raise Exception("Please upload an image first.")
+                    if not st.session_state.get("img_prompt_inspire", "").strip():
+                        raise Exception("Please enter a prompt.")
+                    job_fn = functools.partial(
+                        run_kontext_job,
+                        prompt=st.session_state["img_prompt_inspire"].strip(),
+                        image_bytes=input_bytes,
+                        mime_type=input_mime,
+                    )
+                    label = "🎨 Generating your image"
+
+                else:  # Combine Images mode
+                    # Build list of files for upload
+                    files_for_upload = []
+                    
+                    # Add chained image first if available
+                    if prefilled:
+                        from io import BytesIO
+                        chained_file = BytesIO(prefilled)
+                        chained_file.name = "chained_image.png"
+                        chained_file.type = "image/png"
+                        files_for_upload.append(chained_file)
+                    
+                    # Add uploaded files
+                    if multi_files:
+                        remaining_slots = max(0, 4 - len(files_for_upload))
+                        files_for_upload.extend(multi_files[:remaining_slots])
+                    
+                    # Validation
+                    if not files_for_upload:
+                        raise Exception("Please upload at least 1 image (or reuse the previous output).")
+                    
+                    if not st.session_state.get("img_prompt_combine", "").strip():
+                        raise Exception("Please enter a prompt.")
+                    
+                    # Generate image using multi-image kontext
+                    job_fn = functools.partial(
+                        run_combine_job,
+                        prompt=st.session_state["img_prompt_combine"].strip(),
+                        image_files=files_for_upload,
+                        aspect_ratio=st.session_state.get("combine_aspect", "match_input_image"),
+                    )
+                    label = "🎨 Combining your images"
+
+                # Clear the previous result; the new one arrives via the job
+                st.session_state.generated_image = None
+                st.session_state.generated_images = None
+                st.session_state.generation_success = None
+                st.session_state.generation_error = None
+                job = job_manager.submit(sid, job_fn, label=label, total=total)
 
-                    # Store the generated image in session state for persistent display
-                    st.session_state.generated_image = img_bytes
-                    st.session_state.generation_success = True
-                    st.session_state.generation_error = None
+            except Exception as e:
+                st.session_state.generation_success = False
+                st.session_state.generation_error = str(e)
+                st.session_state.generated_image = None
 
-                except Exception as e:
-                    st.session_state.generation_success = False
-                    st.session_state.generation_error = str(e)
-                    st.session_state.generated_image = None
+    # ---------- Background job: re-attach on every rerun ----------
+    if job and job.done:
+        collect_job(job)
+        job_manager.discard(sid, job.id)
+    elif job:
+        render_job_progress(sid)
 
     # Display results outside the spinner and button logic
-    if st.session_state.get("generation_success"):
+    if st.session_state.get("generation_success") and st.session_state.get("generated_images"):
+        images = st.session_state.generated_images
+        st.success(f"✅ Generated {sum(1 for img in images if img)} of {len(images)} variations!")
+        if st.session_state.get("generation_error"):
+            st.warning(st.session_state.generation_error)
+
+        grid_cols = st.columns(min(len(images), 4))
+        for i, img in enumerate(images):
+            with grid_cols[i % len(grid_cols)]:
+                if img:
+                    st.image(img, caption=f"Variation {i+1}", use_container_width=True)
+                    st.download_button(
+                        label="📥 Download",
+                        data=img,
+                        file_name=f"generated_image_{i+1}.png",
+                        mime="image/png",
+                        key=f"download_variation_{i}",
+                        use_container_width=True
+                    )
+                else:
+                    st.error(f"❌ Variation {i+1} failed")
+
+    elif st.session_state.get("generation_success"):
         st.success("✅ Image generated successfully!")
         
         # Display the image persistently
@@ -1066,6 +1230,10 @@ with tab2:
         st.session_state.generated_image = None
     if "generation_error" not in st.session_state:
         st.session_state.generation_error = None
+    if "generated_images" not in st.session_state:
+        st.session_state.generated_images = None
+
+    render_provider_metrics()
 
 # ---- Footer ----
 st.markdown("---")
@@ -0,0 +1,81 @@
+# bench_json_parsing.py
+#
+# Benchmark corpus of messy chat-model replies for json_parsing.scan_first_json,
+# compared against the regex extraction it replaced. Run:
+#
+#     python bench_json_parsing.py
+#
+# Prints, per case, whether each extractor recovered the expected object and
+# how long it took. The "brace storm" cases are where the old regex backtracks.
+
+import json
+import re
+import time
+
+from json_parsing import JSONScanError, scan_first_json
+
+BODY = {"body": "Hi {{customer_name}}, 20% off today only!", "placeholders": ["{{customer_name}}"], "length": 42, "variant_id": "v1"}
+BODY_JSON = json.dumps(BODY)
+NESTED = {"body": "x", "meta": {"a": {"b": {"c": [1, {"d": 2}]}}}, "placeholders": [], "length": 1, "variant_id": "v2"}
+
+CORPUS = [
+    ("clean object", BODY_JSON, BODY),
+    ("code fence", f"```json\n{BODY_JSON}\n```", BODY),
+    ("prose before and after", f"Sure! Here is your campaign:\n{BODY_JSON}\nLet me know if you need edits.", BODY),
+    ("placeholder braces in prose", f"Use {{{{customer_name}}}} for personalisation. {BODY_JSON}", BODY),
+    ("braces inside strings", json.dumps({"body": "Use } and { freely \" ok", "placeholders": [], "length": 1, "variant_id": None}),
+     {"body": "Use } and { freely \" ok", "placeholders": [], "length": 1, "variant_id": None}),
+    ("nested three levels", f"Result: {json.dumps(NESTED)}", NESTED),
+    ("two objects", f"{BODY_JSON}\n{json.dumps(NESTED)}", BODY),
+    ("unicode and emoji", json.dumps({"body": "Grüße 🎉", "placeholders": [], "length": 8, "variant_id": "v3"}, ensure_ascii=False),
+     {"body": "Grüße 🎉", "placeholders": [], "length": 8, "variant_id": "v3"}),
+    ("truncated reply", BODY_JSON[:-10], None),
+    ("brace storm then object", "{" * 2000 + " oops " + "}" * 1999 + f" {BODY_JSON}", BODY),
+    ("long unbalanced prose", "{[ " * 5000 + BODY_JSON, BODY),
+    ("many small bad candidates", "{x} " * 5000 + BODY_JSON, BODY),
+    ("array before object", f"Variant [1]:\n{BODY_JSON}", BODY),
+    ("stray brace in prose", 'Note: set a { here. {"a":1}', {"a": 1}),
+    ("whole reply is an array", f"```json\n[{BODY_JSON}]\n```", BODY),
+    ("nesting too deep", '{"a":' * 1000 + "1" + "}" * 1000, None),
+    ("too deep then object", '{"a":' * 1000 + "1" + "}" * 1000 + f" {BODY_JSON}", BODY),
+    ("unterminated object then object", '{"draft": "cut off {"a": 1}', {"a": 1}),
+]
+
+OLD_PATTERN = r'\{(?:[^{}]|{[^{}]*})*\}'
+
+
+def old_extract(text):
+    """The previous regex-based fallback from extract_first_json."""
+    for match in re.findall(OLD_PATTERN, text, re.DOTALL):
+        try:
+            return json.loads(match)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def new_extract(text):
+    try:
+        value, _, _ = scan_first_json(text)
+    except JSONScanError:
+        return None
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return value if isinstance(value, dict) else None
+
+
+def timed(fn, text, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(text)
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+if __name__ == "__main__":
+    print(f"{'case':32} {'regex':>14} {'scanner':>14}")
+    for name, text, expected in CORPUS:
+        old_result, old_ms = timed(old_extract, text)
+        new_result, new_ms = timed(new_extract, text)
+        old_mark = "ok" if old_result == expected else "MISS"
+        new_mark = "ok" if new_result == expected else "MISS"
+        print(f"{name:32} {old_mark:>4} {old_ms:8.3f}ms {new_mark:>4} {new_ms:8.3f}ms")
@@ -0,0 +1,239 @@
+# call_scheduler.py
+#
+# Process-wide admission control for outbound Replicate and OpenAI calls,
+# shared by every Streamlit session. Three limits apply before a call may
+# start:
+#
+#   * a token bucket per provider (request rate, with some burst),
+#   * a concurrency cap per model (predictions/completions in flight),
+#   * per-session fairness: callers waiting for the same model are served
+#     round-robin across sessions. A call's turn is the session's calls in
+#     flight plus its calls queued ahead of it; ties go to the session served
+#     least recently, then FIFO. A session that queues a batch therefore
+#     cannot push a single call from another session behind all of it.
+#
+# A 429 (or 5xx with Retry-After) from a provider pauses that provider's
+# bucket for everyone, so one session's rate-limit hit slows all sessions
+# down instead of each of them hammering the API in turn. Waiting callers can
+# be shown their queue position via queue_position().
+
+import asyncio
+import contextvars
+import itertools
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+
+# (requests per second, burst size) per provider
+PROVIDER_RATES = {
+    "replicate": (10.0, 20),  # prediction create limit is 600/min
+    "openai": (5.0, 10),
+}
+
+# Max calls in flight per model; anything unlisted gets the default
+MODEL_CONCURRENCY = {
+    "black-forest-labs/flux-schnell": 8,
+    "black-forest-labs/flux-kontext-max": 4,
+    "flux-kontext-apps/multi-image-list": 4,
+    "gpt-4o-mini": 16,
+}
+DEFAULT_CONCURRENCY = 4
+
+# Upper bound on a single sleep while waiting, so cancelled/expired waits and
+# freed slots are noticed promptly
+WAIT_SLICE = 0.25
+# Never honour a Retry-After longer than this
+MAX_RETRY_AFTER = 60.0
+
+# Session the current thread/task is working for; set by job_manager for
+# background jobs, falls back to the Streamlit script's session.
+CURRENT_SESSION = contextvars.ContextVar("call_scheduler_session", default=None)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for `seconds` (provider asked us to back off)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+@dataclass
+class Ticket:
+    provider: str
+    model: str
+    session: str
+    seq: int
+    granted: bool = False
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+_buckets = {name: TokenBucket(rate, burst) for name, (rate, burst) in PROVIDER_RATES.items()}
+_waiting = []
+_active_by_model = Counter()
+_active_by_session = Counter()
+_last_grant = {}  # session -> grant number of its latest admitted call (one int per session)
+_grants = itertools.count()
+_seq = itertools.count()
+_cond = threading.Condition()
+
+
+def current_session():
+    session = CURRENT_SESSION.get()
+    if session:
+        return session
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        return ctx.session_id if ctx else None
+    except ImportError:
+        return None
+
+
+def _ordered_waiters(model: str) -> list:
+    """Waiters for a model in the order they will be admitted (see module comment)."""
+    ahead = Counter()  # session -> its calls already counted, in FIFO order
+    keyed = []
+    for t in sorted((t for t in _waiting if t.model == model), key=lambda t: t.seq):
+        turn = _active_by_session[t.session] + ahead[t.session]
+        keyed.append(((turn, _last_grant.get(t.session, -1), t.seq), t))
+        ahead[t.session] += 1
+    return [t for _, t in sorted(keyed, key=lambda kt: kt[0])]
+
+
+def enqueue(provider: str, model: str, session: str = None) -> Ticket:
+    ticket = Ticket(provider=provider, model=model, session=session or current_session() or "", seq=next(_seq))
+    with _cond:
+        _waiting.append(ticket)
+    return ticket
+
+
+def try_grant(ticket: Ticket) -> float:
+    """Admit the ticket if all limits allow; return 0.0 when granted, else seconds to wait."""
+    with _cond:
+        if ticket.granted:
+            return 0.0
+        if _active_by_model[ticket.model] >= MODEL_CONCURRENCY.get(ticket.model, DEFAULT_CONCURRENCY):
+            return WAIT_SLICE
+        if _ordered_waiters(ticket.model)[0] is not ticket:
+            return WAIT_SLICE
+        bucket = _buckets.get(ticket.provider)
+        if bucket:
+            delay = bucket.delay()
+            if delay > 0:
+                return min(delay, WAIT_SLICE)
+            bucket.take()
+        _waiting.remove(ticket)
+        _active_by_model[ticket.model] += 1
+        _active_by_session[ticket.session] += 1
+        _last_grant[ticket.session] = next(_grants)
+        ticket.granted = True
+        return 0.0
+
+
+def release(ticket: Ticket):
+    """Free a granted slot, or drop a ticket that is still waiting."""
+    with _cond:
+        if ticket.granted:
+            ticket.granted = False
+            _active_by_model[ticket.model] -= 1
+            _active_by_session[ticket.session] -= 1
+        elif ticket in _waiting:
+            _waiting.remove(ticket)
+        _cond.notify_all()
+
+
+def acquire(provider: str, model: str, session: str = None) -> Ticket:
+    """Block until a call to `model` on `provider` may start."""
+    ticket = enqueue(provider, model, session)
+    try:
+        while True:
+            delay = try_grant(ticket)
+            if not delay:
+                return ticket
+            with _cond:
+                _cond.wait(delay)
+    except BaseException:
+        release(ticket)
+        raise
+
+
+async def acquire_async(provider: str, model: str, session: str = None) -> Ticket:
+    """acquire() for coroutines: waits with asyncio.sleep instead of blocking the loop."""
+    ticket = enqueue(provider, model, session)
+    try:
+        while True:
+            delay = try_grant(ticket)
+            if not delay:
+                return ticket
+            await asyncio.sleep(delay)
+    except BaseException:
+        release(ticket)
+        raise
+
+
+@contextmanager
+def slot(provider: str, model: str, session: str = None):
+    """`with slot("openai", "gpt-4o-mini"):` around one outbound call."""
+    ticket = acquire(provider, model, session)
+    try:
+        yield ticket
+    finally:
+        release(ticket)
+
+
+def queue_position(session: str):
+    """1-based position of the session's earliest waiting call in its model's queue, or None."""
+    with _cond:
+        positions = [
+            _ordered_waiters(t.model).index(t) + 1
+            for t in _waiting if t.session == session
+        ]
+    return min(positions) if positions else None
+
+
+def retry_after(headers) -> float:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    value = (headers or {}).get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return max(0.0, min(seconds, MAX_RETRY_AFTER))
+
+
+def backoff(provider: str, seconds: float):
+    """Pause a provider's bucket for every session (after a 429/5xx)."""
+    with _cond:
+        bucket = _buckets.get(provider)
+        if bucket:
+            bucket.pause(seconds)
@@ -0,0 +1,71 @@
+# chat_context.py
+#
+# Keeps the messages sent for campaign edits bounded. Every edit turn already
+# embeds `base_campaign` and `previous_output`, so anything older than the
+# newest such turn is redundant: the request only needs the system prompt
+# plus the newest edit context, within a token budget. Token counts are a
+# character-based estimate (no tokenizer dependency), good enough for
+# budgeting and for reporting what trimming saved.
+
+import json
+
+DEFAULT_TOKEN_BUDGET = 6000
+
+# Rough per-message framing overhead and characters per token for gpt-4o-mini
+MESSAGE_OVERHEAD_TOKENS = 4
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(messages) -> int:
+    """Approximate prompt tokens for a list of chat messages."""
+    total = 0
+    for message in messages:
+        total += MESSAGE_OVERHEAD_TOKENS + -(-len(message.get("content") or "") // CHARS_PER_TOKEN)
+    return total
+
+
+def is_self_contained(message) -> bool:
+    """True for a user edit turn that carries its own base_campaign and previous_output."""
+    if message.get("role") != "user":
+        return False
+    try:
+        content = json.loads(message.get("content") or "")
+    except ValueError:
+        return False
+    return isinstance(content, dict) and "previous_output" in content and "base_campaign" in content
+
+
+def trim_history(messages, budget: int = DEFAULT_TOKEN_BUDGET):
+    """
+    Return (trimmed_messages, stats). The system prompt and the newest message
+    are always kept; older turns are added newest-first while they fit the
+    budget, stopping at the first self-contained edit turn since everything
+    before it is already embedded in it.
+    """
+    if not messages:
+        return [], {"original_tokens": 0, "sent_tokens": 0, "saved_tokens": 0, "dropped_messages": 0, "over_budget": False}
+
+    system = [messages[0]] if messages[0].get("role") == "system" else []
+    turns = messages[len(system):]
+    kept = turns[-1:]
+    used = estimate_tokens(system + kept)
+
+    for message in reversed(turns[:-1]):
+        if is_self_contained(kept[0]):
+            break
+        cost = estimate_tokens([message])
+        if used + cost > budget:
+            break
+        kept.insert(0, message)
+        used += cost
+
+    trimmed = system + kept
+    original = estimate_tokens(messages)
+    stats = {
+        "original_tokens": original,
+        "sent_tokens": used,
+        "saved_tokens": original - used,
+        "dropped_messages": len(messages) - len(trimmed),
+        "over_budget": used > budget,
+    }
+    return trimmed, stats
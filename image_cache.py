@@ -0,0 +1,134 @@
+# image_cache.py
+#
+# Opt-in, content-addressed cache of generated images on local disk. The key
+# is a hash of the model slug, the whitespace-normalised prompt and every
+# other prediction input (seed, aspect ratio, output format, ...). Entries are
+# evicted least-recently-used first once the cache exceeds MAX_CACHE_BYTES or
+# MAX_CACHE_ENTRIES; file mtimes double as the LRU clock so the cache survives
+# restarts and is shared by every session on the host.
+#
+# Only deterministic requests belong here: callers should skip the cache when
+# no fixed seed is given, otherwise every "random" image would be identical.
+
+import hashlib
+import json
+import os
+import threading
+
+CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", ".image_cache")
+MAX_CACHE_BYTES = 500 * 1024 * 1024
+MAX_CACHE_ENTRIES = 1000
+
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+_lock = threading.Lock()
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join((prompt or "").split())
+
+
+def cache_key(model_slug: str, model_input: dict) -> str:
+    """Stable hash of the model and its (normalised) inputs."""
+    params = dict(model_input)
+    if "prompt" in params:
+        params["prompt"] = normalize_prompt(params["prompt"])
+    blob = json.dumps({"model": model_slug, "input": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _path(key: str) -> str:
+    return os.path.join(CACHE_DIR, key[:2], key)
+
+
+def _count(name: str, amount: int = 1):
+    with _lock:
+        _stats[name] += amount
+
+
+def get(key: str):
+    """Return cached bytes for a key, or None. A hit refreshes the entry's LRU position."""
+    path = _path(key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path, None)
+    except OSError:
+        _count("misses")
+        return None
+    _count("hits")
+    return data
+
+
+def put(key: str, data: bytes) -> bool:
+    """
+    Store bytes under a key (atomically) and evict old entries if over budget.
+    A failed write (disk full, read-only volume) only costs the cache entry.
+    """
+    path = _path(key)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    _count("writes")
+    evict()
+    return True
+
+
+def _entries():
+    entries = []
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+    return entries
+
+
+def evict():
+    """Remove least-recently-used entries until both size and count limits hold."""
+    entries = sorted(_entries())
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    while entries and (total > MAX_CACHE_BYTES or len(entries) > MAX_CACHE_ENTRIES):
+        _, size, path = entries.pop(0)
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        _count("evictions", removed)
+
+
+def stats() -> dict:
+    """Process-wide counters plus the current on-disk footprint."""
+    with _lock:
+        result = dict(_stats)
+    entries = _entries()
+    result["entries"] = len(entries)
+    result["bytes"] = sum(size for _, size, _ in entries)
+    lookups = result["hits"] + result["misses"]
+    result["hit_rate"] = result["hits"] / lookups if lookups else 0.0
+    return result
+
+
+def clear():
+    for _, _, path in _entries():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,114 @@
+# image_download.py
+#
+# Streaming download of generated images. Outputs are read in chunks into an
+# in-memory buffer whose storage becomes the returned bytes object (no
+# second copy, no temp-file round trip), with:
+#   - a Content-Length check against a size cap before the body is read,
+#   - the same cap enforced while streaming (the header may be missing),
+#   - an image signature check on the first bytes, so an HTML error page or
+#     truncated body fails fast,
+#   - per-read timeouts plus an overall deadline, so a hung CDN response
+#     cannot pin a worker thread.
+
+import io
+import time
+
+MAX_DOWNLOAD_BYTES = 25 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+# (connect, read) timeouts for each socket operation, and a wall-clock cap
+DOWNLOAD_TIMEOUT = (5, 30)
+DOWNLOAD_DEADLINE = 120
+
+# Leading bytes of the formats our models return
+IMAGE_SIGNATURES = (
+    b"\x89PNG\r\n\x1a\n",
+    b"\xff\xd8\xff",  # JPEG
+    b"GIF87a",
+    b"GIF89a",
+)
+SIGNATURE_BYTES = 12
+
+
+def looks_like_image(head: bytes) -> bool:
+    """True if the first bytes match a known image signature."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return True
+    return any(head.startswith(sig) for sig in IMAGE_SIGNATURES)
+
+
+def check_content_length(headers, max_bytes: int):
+    length = headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise Exception(f"Image is too large ({int(length)} bytes, limit {max_bytes})")
+
+
+class _BufferWriter:
+    """Accumulates chunks, enforcing the cap, deadline and image signature."""
+
+    def __init__(self, max_bytes: int, deadline: float):
+        self.max_bytes = max_bytes
+        self.deadline = deadline
+        self.size = 0
+        self.head = b""
+        self.buffer = io.BytesIO()
+
+    def write(self, chunk: bytes):
+        if time.monotonic() > self.deadline:
+            raise Exception(f"Image download took longer than {DOWNLOAD_DEADLINE} seconds")
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise Exception(f"Image is too large (over {self.max_bytes} bytes)")
+        if len(self.head) < SIGNATURE_BYTES:
+            self.head += chunk[:SIGNATURE_BYTES - len(self.head)]
+            if len(self.head) >= SIGNATURE_BYTES and not looks_like_image(self.head):
+                raise Exception("Downloaded file is not a recognised image")
+        self.buffer.write(chunk)
+
+    def finish(self) -> bytes:
+        if not looks_like_image(self.head):
+            raise Exception("Downloaded file is not a recognised image")
+        # getvalue() hands over the BytesIO's own storage rather than copying
+        # it; closing afterwards just drops the buffer's reference.
+        data = self.buffer.getvalue()
+        self.buffer.close()
+        return data
+
+    def close(self):
+        self.buffer.close()
+
+
+def download_bytes(session, url: str, max_bytes: int = MAX_DOWNLOAD_BYTES, stop=None) -> bytes:
+    """
+    Stream `url` through a requests session and return the image bytes.
+    `stop` (a threading.Event) abandons the download at the next chunk.
+    """
+    writer = _BufferWriter(max_bytes, time.monotonic() + DOWNLOAD_DEADLINE)
+    try:
+        with session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as resp:
+            resp.raise_for_status()
+            check_content_length(resp.headers, max_bytes)
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                if stop is not None and stop.is_set():
+                    raise Exception("Download superseded by a faster request")
+                writer.write(chunk)
+        return writer.finish()
+    except BaseException:
+        writer.close()
+        raise
+
+
+async def download_bytes_async(client, url: str, max_bytes: int = MAX_DOWNLOAD_BYTES, timeout=None) -> bytes:
+    """httpx.AsyncClient version of download_bytes; `timeout` is an httpx.Timeout."""
+    writer = _BufferWriter(max_bytes, time.monotonic() + DOWNLOAD_DEADLINE)
+    stream_kwargs = {"timeout": timeout} if timeout is not None else {}
+    try:
+        async with client.stream("GET", url, **stream_kwargs) as resp:
+            resp.raise_for_status()
+            check_content_length(resp.headers, max_bytes)
+            async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                writer.write(chunk)
+        return writer.finish()
+    except BaseException:
+        writer.close()
+        raise
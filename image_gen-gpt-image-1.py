@@ -1,8 +1,8 @@
 import streamlit as st
-import openai
-import requests
 import os
 
+import providers
+
 # Theme and layout
 MINT = "#DFF6EF"
 GMS_GREEN = "#18BC62"
@@ -360,26 +360,13 @@ if generate_clicked:
         
         with st.spinner("🎨 Generating your visual..."):
             try:
-                # Get API key from secrets
-                api_key = st.secrets["OPENAI_API_KEY"]
-                openai.api_key = api_key
-                
-                # Prepare API parameters based on OpenAI gpt-image-1 specification
-                api_params = {
-                    "model": "gpt-image-1",
-                    "prompt": final_prompt,
-                    "size": "1024x1024",
-                    "quality": "low",
-                    "background": background.lower()  # "opaque" or "transparent"
-                }
-                
-                # Make API call
-                response = openai.images.generate(**api_params)
-                
-                # Handle response - gpt-image-1 returns URL for both transparent and opaque
-                image_url = response.data[0].url
-                img_response = requests.get(image_url)
-                img_bytes = img_response.content
+                # Generate and decode/download via the shared gpt-image-1 provider
+                img_bytes = providers.get_provider("gpt-image-1").generate(
+                    final_prompt,
+                    size="1024x1024",
+                    quality="low",
+                    background=background.lower(),  # "opaque" or "transparent"
+                )
                 
                 st.success("✅ Visual generated successfully!")
                 st.image(img_bytes, caption=f"Generated Image (1024×1024) - {background} Background", use_column_width=True)
@@ -1,10 +1,10 @@
 # image_gen.py
 
 import streamlit as st
-from openai import OpenAI
-import requests
 import os
-import time
+
+import providers
+from openai_client import get_openai_client
 
 # -----------------------------------------------------------------------------
 # System prompt for GPT-4o-mini to refine Flux prompts
@@ -35,7 +35,7 @@ Any deviation from this specification must result in the single-line error above
 def enhance_prompt(raw_prompt: str) -> str:
     """Call GPT-4o-mini to refine the raw prompt."""
     try:
-        client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+        client = get_openai_client()
         resp = client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
@@ -50,62 +50,8 @@ def enhance_prompt(raw_prompt: str) -> str:
         raise Exception(f"OpenAI API error: {str(e)}")
 
 def generate_flux(prompt: str) -> bytes:
-    """Call Replicate Flux Schnell API and return image bytes."""
-    token = st.secrets["REPLICATE_API_TOKEN"]
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "input": {
-            "prompt": prompt
-        }
-    }
-    
-    api_endpoint = "https://api.replicate.com/v1/models/black-forest-labs/flux-schnell/predictions"
-    
-    try:
-        resp = requests.post(api_endpoint, headers=headers, json=payload)
-        resp.raise_for_status()
-        prediction = resp.json()
-        prediction_id = prediction["id"]
-        
-        # Poll until completion with timeout
-        max_wait_time = 300  # 5 minutes
-        start_time = time.time()
-        
-        while time.time() - start_time < max_wait_time:
-            status_resp = requests.get(f"https://api.replicate.com/v1/predictions/{prediction_id}", headers=headers)
-            status_resp.raise_for_status()
-            status_data = status_resp.json()
-            
-            if status_data["status"] == "succeeded":
-                outputs = status_data["output"]
-                if isinstance(outputs, list) and len(outputs) > 0:
-                    image_url = outputs[0]
-                elif isinstance(outputs, str):
-                    image_url = outputs
-                else:
-                    raise Exception("No valid output URL found")
-                
-                # Download the image
-                img_resp = requests.get(image_url)
-                img_resp.raise_for_status()
-                return img_resp.content
-                
-            elif status_data["status"] == "failed":
-                error_msg = status_data.get("error", "Unknown error")
-                raise Exception(f"Prediction failed: {error_msg}")
-            
-            time.sleep(2)  # Wait 2 seconds before next poll
-        
-        raise Exception("Generation timed out after 5 minutes")
-        
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Replicate API request error: {str(e)}")
-    except Exception as e:
-        raise Exception(f"Image generation error: {str(e)}")
+    """Generate with Flux Schnell on Replicate and return image bytes."""
+    return providers.get_provider("flux-schnell").generate(prompt)
 
 # -----------------------------------------------------------------------------
 # Page configuration & styling to match Content Builder MVP exactly
@@ -1,8 +1,8 @@
 import streamlit as st
-import openai
-import requests
 import os
 
+import providers
+
 # Theme and layout
 MINT = "#DFF6EF"
 GMS_GREEN = "#18BC62"
@@ -320,26 +320,10 @@ if generate_clicked:
         
         with st.spinner("🎨 Generating your visual..."):
             try:
-                # Get API key from secrets
-                api_key = st.secrets["OPENAI_API_KEY"]
-                openai.api_key = api_key
-                
                 size = channels[channel]
                 
-                # Make API call
-                response = openai.images.generate(
-                    model="dall-e-3",
-                    prompt=final_prompt,
-                    size=size,
-                    quality="standard",
-                    n=1,
-                )
-                
-                image_url = response.data[0].url
-                
-                # Download and display image
-                img_response = requests.get(image_url)
-                img_bytes = img_response.content
+                # Generate and download via the shared DALL-E 3 provider
+                img_bytes = providers.get_provider("dall-e-3").generate(final_prompt, size=size)
                 
                 st.success("✅ Visual generated successfully!")
                 st.image(img_bytes, caption=f"Generated for: {channel}", use_column_width=True)
@@ -0,0 +1,64 @@
+# image_preprocess.py
+#
+# Normalises user-supplied images before they are uploaded to Replicate
+# (Inspire and Combine Images modes, see replicate_files.input_url). Raw
+# uploads can be multi-megabyte camera photos or GIFs. Each image is
+# rotated per its EXIF orientation, flattened to RGB (first frame only for
+# animations, transparency composited onto white), downsized to the model's
+# effective input resolution and re-encoded as high-quality JPEG, which also
+# drops EXIF/ICC/XMP metadata. Anything Pillow cannot decode is passed through
+# unchanged so the model can report the error.
+
+import io
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Kontext models work at roughly one megapixel; larger inputs are downscaled
+# on Replicate's side anyway, so sending more only costs upload time.
+DEFAULT_MAX_PIXELS = 1024 * 1024
+MODEL_MAX_PIXELS = {
+    "black-forest-labs/flux-kontext-max": 1024 * 1024,
+    "flux-kontext-apps/multi-image-list": 1024 * 1024,
+}
+
+JPEG_QUALITY = 92
+BACKGROUND = (255, 255, 255)
+
+
+def _flatten(img):
+    """RGB copy of an image with any transparency composited onto BACKGROUND."""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        flat = Image.new("RGB", rgba.size, BACKGROUND)
+        flat.paste(rgba, mask=rgba.getchannel("A"))
+        return flat
+    return img.convert("RGB")
+
+
+def _downsize(img, max_pixels: int):
+    pixels = img.width * img.height
+    if pixels <= max_pixels:
+        return img
+    scale = (max_pixels / pixels) ** 0.5
+    size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+    return img.resize(size, Image.LANCZOS)
+
+
+def normalize_image(data: bytes, model_slug: str = None, mime_type: str = "image/png"):
+    """
+    Return (bytes, mime_type) ready for upload: EXIF-rotated, metadata-free,
+    RGB, at most the model's max resolution, JPEG-encoded. Undecodable input
+    is returned as-is with its original mime type.
+    """
+    max_pixels = MODEL_MAX_PIXELS.get(model_slug, DEFAULT_MAX_PIXELS)
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.seek(0)
+            img = ImageOps.exif_transpose(img)
+            img = _downsize(_flatten(img), max_pixels)
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True, subsampling=0)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return data, mime_type or "image/png"
+    return out.getvalue(), "image/jpeg"
+
@@ -0,0 +1,170 @@
+# job_manager.py
+#
+# Process-level background jobs for image generation. A Streamlit rerun
+# (any widget touch) abandons whatever the script thread was doing, so
+# predictions run on a shared thread pool instead and are registered under
+# the browser session's id. Each rerun looks up the session's current job and
+# re-attaches to it: still running -> show progress and poll, finished -> pick
+# up the result. Job functions must not touch st.session_state or render
+# anything; they report partial results through job.partial. Cancelling or
+# superseding a job also cancels its predictions on Replicate.
+#
+# The pool is sized above the sum of call_scheduler's per-model caps, so jobs
+# normally start at once and wait for a model slot inside call_scheduler,
+# where queue_position() can see them. Past that, jobs wait in the pool's own
+# backlog, which backlog_position() reports.
+
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import streamlit as st
+
+import call_scheduler
+import replicate_client
+
+# Job threads mostly sleep on HTTP and polls; leave room beyond the model caps
+MAX_WORKERS = sum(call_scheduler.MODEL_CONCURRENCY.values()) + 8
+# Finished jobs nobody came back for are dropped after this many seconds
+JOB_TTL_SECONDS = 60 * 60
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="image-job")
+_jobs = {}  # session id -> latest Job
+_backlog = deque()  # submitted jobs no worker has picked up yet, oldest first
+_lock = threading.Lock()
+
+
+@dataclass
+class Job:
+    session_id: str
+    label: str
+    total: int = 1  # number of outputs the job produces
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "running"  # running | succeeded | failed (running includes queued)
+    result: object = None
+    error: str = None
+    partial: dict = field(default_factory=dict)  # index -> bytes or Exception, for multi-output jobs
+    started_at: float = field(default_factory=time.time)  # submit time
+    picked_up: bool = False  # a worker thread has started it
+    finished_at: float = None
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+
+    @property
+    def done(self) -> bool:
+        return self.status != "running"
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+
+def session_id() -> str:
+    """Id of the current browser session (stable across reruns)."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        if ctx is not None:
+            return ctx.session_id
+    except ImportError:
+        pass
+    if "_job_session_id" not in st.session_state:
+        st.session_state._job_session_id = uuid.uuid4().hex
+    return st.session_state._job_session_id
+
+
+def _run(job: Job, fn):
+    with _lock:
+        job.picked_up = True
+        _backlog.remove(job)
+    if job.cancel_event.is_set():
+        job.status = "failed"
+        job.error = "Cancelled"
+        job.finished_at = time.time()
+        return
+    call_scheduler.CURRENT_SESSION.set(job.session_id)
+    replicate_client.CANCEL_EVENT.set(job.cancel_event)
+    try:
+        job.result = fn(job)
+        job.status = "succeeded"
+    except Exception as e:
+        job.error = str(e)
+        job.status = "failed"
+    finally:
+        job.finished_at = time.time()
+
+
+def _prune():
+    cutoff = time.time() - JOB_TTL_SECONDS
+    for sid in [sid for sid, job in _jobs.items() if job.done and job.finished_at < cutoff]:
+        del _jobs[sid]
+
+
+def submit(sid: str, fn, label: str = "", total: int = 1) -> Job:
+    """
+    Run fn(job) in the background as the session's current job and return it.
+    A job the session already had is superseded: it is cancelled, along with
+    its live Replicate predictions.
+    """
+    cancel(sid)
+    job = Job(session_id=sid, label=label, total=total)
+    with _lock:
+        _prune()
+        _jobs[sid] = job
+        _backlog.append(job)
+    _executor.submit(_run, job, fn)
+    return job
+
+
+def current(sid: str):
+    """The session's current job (running or finished and not yet collected), or None."""
+    with _lock:
+        return _jobs.get(sid)
+
+
+def backlog_position(sid: str):
+    """
+    1-based position of the session's job among jobs still waiting for a
+    worker thread, or None once it has started (or the session has none).
+    """
+    with _lock:
+        job = _jobs.get(sid)
+        if job is None or job.picked_up:
+            return None
+        position = 0
+        for queued in _backlog:
+            if not queued.cancel_event.is_set():  # superseded jobs exit as soon as they start
+                position += 1
+            if queued is job:
+                return position
+    return None
+
+
+def discard(sid: str, job_id: str = None):
+    """Forget the session's current job (only if it is still `job_id`, when given)."""
+    with _lock:
+        job = _jobs.get(sid)
+        if job and (job_id is None or job.id == job_id):
+            del _jobs[sid]
+
+
+def cancel(sid: str):
+    """
+    Cancel the session's job: stop it from starting new predictions, cancel
+    the session's live predictions on Replicate (in the background) and
+    forget the job. Returns without waiting on the network.
+    """
+    with _lock:
+        job = _jobs.pop(sid, None)
+    if job and not job.done:
+        # The event alone stops the job; the cancel POSTs can each take up to
+        # API_TIMEOUT, so they go out in the background. The ids are taken
+        # now so a job submitted right after this one is not caught up in it.
+        job.cancel_event.set()
+        live = replicate_client.live_predictions(sid)
+        if live:
+            threading.Thread(
+                target=replicate_client.cancel_predictions, args=(live,), name="cancel-predictions", daemon=True
+            ).start()
@@ -0,0 +1,238 @@
+# json_parsing.py
+#
+# Helpers for JSON produced by chat models, which arrives token by token and
+# is not always clean. partial_string_field() pulls a string field out of a
+# still-unfinished object so the UI can render `body` while it streams;
+# scan_first_json() finds the JSON object in a reply wrapped in prose or code
+# fences (or the array, when the whole reply is one) in linear time.
+
+import json
+import re
+
+WHITESPACE = " \t\r\n"
+HIGH_SURROGATES = ("\ud800", "\udbff")
+
+# Only these characters change the scanner's state, so it can jump between them
+_STRUCTURAL = re.compile(r'[{}\[\]"\\]')
+_CLOSER_FOR = {"{": "}", "[": "]"}
+
+
+class JSONScanError(ValueError):
+    """No complete JSON value could be extracted; `pos`/`lineno`/`colno` say where it failed."""
+
+    def __init__(self, msg: str, text: str, pos: int):
+        self.msg = msg
+        self.pos = pos
+        self.lineno = text.count("\n", 0, pos) + 1
+        self.colno = pos - text.rfind("\n", 0, pos)
+        super().__init__(f"{msg}: line {self.lineno} column {self.colno} (char {pos})")
+
+
+def _string_end(text: str, start: int) -> int:
+    """Index of the quote closing the string opened at `start`, or -1 if unterminated."""
+    i = start + 1
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == '"':
+            return i
+        i += 1
+    return -1
+
+
+def _skip_ws(text: str, i: int) -> int:
+    while i < len(text) and text[i] in WHITESPACE:
+        i += 1
+    return i
+
+
+def _decode_partial_string(text: str, start: int):
+    """Decode the string opened at `start`, stopping before any half-received escape."""
+    end = _string_end(text, start)
+    if end != -1:
+        return json.loads(text[start:end + 1], strict=False), True
+
+    raw = text[start + 1:]
+    safe = 0
+    k = 0
+    while k < len(raw):
+        if raw[k] == "\\":
+            width = 6 if raw[k + 1:k + 2] == "u" else 2
+            if k + width > len(raw):
+                break
+            k += width
+        else:
+            k += 1
+        safe = k
+
+    value = json.loads('"' + raw[:safe] + '"', strict=False)
+    # A high surrogate whose partner has not arrived yet cannot be displayed
+    if value and HIGH_SURROGATES[0] <= value[-1] <= HIGH_SURROGATES[1]:
+        value = value[:-1]
+    return value, False
+
+
+def partial_string_field(text: str, field: str):
+    """
+    Find `"field": "<string>"` on the outermost object of possibly unfinished
+    JSON (nested objects are ignored) and return (value_so_far, complete).
+    Returns (None, False) while the key has not arrived yet or if its value
+    is not a string.
+    """
+    stack = []
+    top_depth = None  # stack depth of the first object opened
+    expect_key = False
+    i = 0
+    n = len(text)
+
+    while i < n:
+        c = text[i]
+        if c == '"':
+            end = _string_end(text, i)
+            if end == -1:
+                return None, False
+            if expect_key:
+                j = _skip_ws(text, end + 1)
+                if j < n and text[j] == ":":
+                    try:
+                        key = json.loads(text[i:end + 1], strict=False)
+                    except ValueError:
+                        key = None
+                    j = _skip_ws(text, j + 1)
+                    if key == field and len(stack) == top_depth:
+                        if j >= n:
+                            return "", False
+                        if text[j] != '"':
+                            return None, False
+                        return _decode_partial_string(text, j)
+                    expect_key = False
+                    i = j
+                    continue
+            i = end + 1
+            continue
+        if c in "{[":
+            stack.append(c)
+            expect_key = c == "{"
+            if c == "{" and top_depth is None:
+                top_depth = len(stack)
+        elif c in "}]":
+            if stack:
+                stack.pop()
+            expect_key = False
+        elif c == ",":
+            expect_key = bool(stack) and stack[-1] == "{"
+        i += 1
+
+    return None, False
+
+
+def _balanced_end(text: str, start: int, known: dict):
+    """
+    Walk the object/array opened at `start`, honouring strings and escapes.
+    Returns (end, None) with `end` one past the matching closer, or
+    (pos, reason) where the candidate broke. The outcome for every opener
+    nested inside it is recorded in `known` (opener position -> same tuple),
+    so later candidates starting there need no second walk.
+    """
+    stack = []  # (expected closer, opener position)
+    in_string = False
+    skip_to = -1
+    for m in _STRUCTURAL.finditer(text, start):
+        pos = m.start()
+        if pos < skip_to:
+            continue
+        c = m.group()
+        if in_string:
+            if c == "\\":
+                skip_to = pos + 2
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in _CLOSER_FOR:
+            stack.append((_CLOSER_FOR[c], pos))
+        elif c == "\\":
+            continue
+        elif c != stack[-1][0]:
+            reason = f"Expected '{stack[-1][0]}' but found '{c}'"
+            for _, opened in stack:
+                known[opened] = (pos, reason)
+            return pos, reason
+        else:
+            _, opened = stack.pop()
+            known[opened] = (pos + 1, None)
+            if not stack:
+                return pos + 1, None
+    for _, opened in stack:
+        kind = "object" if text[opened] == "{" else "array"
+        what = "Unterminated string in" if in_string else "Unterminated"
+        known[opened] = (len(text), f"{what} {kind} starting at char {opened}")
+    return known[start]
+
+
+def _strip_fence(text: str):
+    """(inner, offset) of a reply with surrounding whitespace and one ``` fence removed."""
+    stripped = text.strip()
+    offset = text.find(stripped)
+    if stripped.startswith("```") and stripped.endswith("```") and len(stripped) >= 6:
+        newline = stripped.find("\n")
+        if newline != -1:
+            inner = stripped[newline + 1:-3]
+            offset += newline + 1
+            lead = len(inner) - len(inner.lstrip())
+            return inner.strip(), offset + lead
+    return stripped, offset
+
+
+def scan_first_json(text: str):
+    """
+    Return (value, start, end) for the JSON value in a model reply. An array
+    is only accepted when it is the whole reply (optionally in a ``` fence);
+    inside prose, only objects count, so "Variant [1]: {...}" yields the
+    object. Candidates that fail are retried from the next opener, so a
+    stray "{" in prose does not hide a valid object after it; the outcome of
+    every nested opener is memoised, so this stays linear on typical input.
+    Candidates nested too deeply for json.loads count as failed. Raises
+    JSONScanError with the position of the last failure when nothing parses.
+    """
+    whole, offset = _strip_fence(text)
+    if whole.startswith("[") and whole.endswith("]"):
+        try:
+            return json.loads(whole, strict=False), offset, offset + len(whole)
+        except (json.JSONDecodeError, RecursionError):
+            pass
+
+    error = None
+    known = {}
+    i = 0
+    while True:
+        start = text.find("{", i)
+        if start == -1:
+            break
+        i = start + 1
+        # Cheap reject for prose like {{customer_name}} or "a { here": an
+        # object's first token must be a key or the closing brace
+        first = _skip_ws(text, start + 1)
+        if first >= len(text) or text[first] not in '"}':
+            error = ("Expecting property name enclosed in double quotes", first)
+            continue
+        end, reason = known[start] if start in known else _balanced_end(text, start, known)
+        if reason:
+            error = (reason, end)
+            continue
+        try:
+            return json.loads(text[start:end], strict=False), start, end
+        except json.JSONDecodeError as e:
+            error = (e.msg, start + e.pos)
+        except RecursionError:
+            # json.loads recurses per nesting level (the scanner does not). Skip
+            # the whole value rather than returning a fragment nested inside it
+            error = ("Nesting too deep to parse", start)
+            i = end
+
+    if error is None:
+        raise JSONScanError("No JSON object or array found", text, len(text))
+    raise JSONScanError(error[0], text, error[1])
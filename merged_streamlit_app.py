@@ -1,56 +1,32 @@
 import streamlit as st
-import openai
 import json
-import re
-import requests
-import os
-import time
-import base64
-from openai import OpenAI
+
+import json_parsing
+import prompt_cache_metrics
+import providers
+import static_assets
+from openai_client import get_openai_client
 
 # ---- JSON handling functions from content builder ----
 def extract_first_json(text):
     """
-    Improved JSON extraction with better error handling
+    Return the JSON object in a model reply (first element if the whole reply
+    is an array), skipping any prose or code fences around it. Uses a linear
+    scanner instead of a regex, so brace-heavy text cannot make it backtrack.
     """
-    text = text.strip()
-    
-    # Handle array format
-    if text.startswith("["):
-        try:
-            arr = json.loads(text)
-            return arr[0] if arr else {}
-        except json.JSONDecodeError as e:
-            st.error(f"JSON Array Parse Error: {e}")
-            return create_fallback_response()
-    
-    # Handle single object format
-    if text.startswith("{"):
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError as e:
-            st.error(f"JSON Object Parse Error: {e}")
-            return create_fallback_response()
-    
-    # Try to extract JSON from mixed content
     try:
-        # Look for JSON objects in the text
-        json_pattern = r'\{(?:[^{}]|{[^{}]*})*\}'
-        matches = re.findall(json_pattern, text, re.DOTALL)
-        
-        for match in matches:
-            try:
-                return json.loads(match)
-            except json.JSONDecodeError:
-                continue
-        
-        # If no valid JSON found, return fallback
-        return create_fallback_response()
-        
-    except Exception as e:
+        value, _, _ = json_parsing.scan_first_json(text)
+    except json_parsing.JSONScanError as e:
         st.error(f"JSON Extraction Error: {e}")
         return create_fallback_response()
 
+    if isinstance(value, list):
+        value = value[0] if value else {}
+    if not isinstance(value, dict):
+        st.error(f"JSON Extraction Error: expected an object, got {type(value).__name__}")
+        return create_fallback_response()
+    return value
+
 def create_fallback_response():
     """
     Create a safe fallback response when JSON parsing fails
@@ -162,7 +138,7 @@ Any deviation from this specification must result in the single-line error above
 def enhance_prompt(raw_prompt: str) -> str:
     """Call GPT-4o-mini to refine the raw prompt."""
     try:
-        client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+        client = get_openai_client()
         resp = client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
@@ -177,62 +153,8 @@ def enhance_prompt(raw_prompt: str) -> str:
         raise Exception(f"OpenAI API error: {str(e)}")
 
 def generate_flux(prompt: str) -> bytes:
-    """Call Replicate Flux Schnell API and return image bytes."""
-    token = st.secrets["REPLICATE_API_TOKEN"]
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "input": {
-            "prompt": prompt
-        }
-    }
-    
-    api_endpoint = "https://api.replicate.com/v1/models/black-forest-labs/flux-schnell/predictions"
-    
-    try:
-        resp = requests.post(api_endpoint, headers=headers, json=payload)
-        resp.raise_for_status()
-        prediction = resp.json()
-        prediction_id = prediction["id"]
-        
-        # Poll until completion with timeout
-        max_wait_time = 300  # 5 minutes
-        start_time = time.time()
-        
-        while time.time() - start_time < max_wait_time:
-            status_resp = requests.get(f"https://api.replicate.com/v1/predictions/{prediction_id}", headers=headers)
-            status_resp.raise_for_status()
-            status_data = status_resp.json()
-            
-            if status_data["status"] == "succeeded":
-                outputs = status_data["output"]
-                if isinstance(outputs, list) and len(outputs) > 0:
-                    image_url = outputs[0]
-                elif isinstance(outputs, str):
-                    image_url = outputs
-                else:
-                    raise Exception("No valid output URL found")
-                
-                # Download the image
-                img_resp = requests.get(image_url)
-                img_resp.raise_for_status()
-                return img_resp.content
-                
-            elif status_data["status"] == "failed":
-                error_msg = status_data.get("error", "Unknown error")
-                raise Exception(f"Prediction failed: {error_msg}")
-            
-            time.sleep(2)  # Wait 2 seconds before next poll
-        
-        raise Exception("Generation timed out after 5 minutes")
-        
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Replicate API request error: {str(e)}")
-    except Exception as e:
-        raise Exception(f"Image generation error: {str(e)}")
+    """Generate with Flux Schnell on Replicate and return image bytes."""
+    return providers.get_provider("flux-schnell").generate(prompt)
 
 # ---- Page configuration and styling ----
 st.set_page_config(page_title="AI Content & Image Generator", layout="centered")
@@ -260,15 +182,14 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # ---- Logo positioned at top left ----
-if os.path.exists("gms_logo.png"):
+logo_uri = static_assets.image_data_uri("gms_logo.png", 250)
+if logo_uri:
     st.markdown(
         """
         <div style='position: fixed; top: 80px; left: 20px; z-index: 999;'>
-            <img src='data:image/png;base64,{}' width='250'>
+            <img src='{}' width='250'>
         </div>
-        """.format(
-            base64.b64encode(open("gms_logo.png", "rb").read()).decode()
-        ), 
+        """.format(logo_uri), 
         unsafe_allow_html=True
     )
 else:
@@ -378,15 +299,14 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # ---- Magic image at bottom right ----
-if os.path.exists("magic.png"):
+magic_uri = static_assets.image_data_uri("magic.png", 100)
+if magic_uri:
     st.markdown(
         """
         <div class='magic-image'>
-            <img src='data:image/png;base64,{}' width='100'>
+            <img src='{}' width='100'>
         </div>
-        """.format(
-            base64.b64encode(open("magic.png", "rb").read()).decode()
-        ), 
+        """.format(magic_uri), 
         unsafe_allow_html=True
     )
 
@@ -499,8 +419,7 @@ with tab1:
 
     # ---- GENERATE CONTENT: starts a NEW session ----
     if generate_btn and prompt:
-        openai_api_key = st.secrets["OPENAI_API_KEY"]
-        client = openai.OpenAI(api_key=openai_api_key)
+        client = get_openai_client()
 
         # Reset chat history to only system prompt (new session)
         st.session_state.chat_history = [{"role": "system", "content": system_prompt}]
@@ -526,11 +445,12 @@ with tab1:
         try:
             response = client.chat.completions.create(
                 model="gpt-4o-mini",
-                messages=st.session_state.chat_history,
+                messages=prompt_cache_metrics.build_messages(system_prompt, st.session_state.chat_history),
                 max_tokens=2000,
                 temperature=0.7,
                 n=int(variants)
             )
+            prompt_cache_metrics.record_usage(response.usage, "generate")
             
             # Collect variants with robust JSON extraction
             variant_list = []
@@ -625,8 +545,7 @@ with tab1:
 
         # ---- EDIT CONTENT: continue the existing session ----
         if edit_btn and follow_up:
-            openai_api_key = st.secrets["OPENAI_API_KEY"]
-            client = openai.OpenAI(api_key=openai_api_key)
+            client = get_openai_client()
 
             try:
                 # Get JSON-encoded user message and previous assistant message from chat_history
@@ -645,10 +564,11 @@ with tab1:
 
                 response = client.chat.completions.create(
                     model="gpt-4o-mini",
-                    messages=st.session_state.chat_history,
+                    messages=prompt_cache_metrics.build_messages(system_prompt, st.session_state.chat_history),
                     max_tokens=2000,
                     temperature=0.7,
                 )
+                prompt_cache_metrics.record_usage(response.usage, "edit")
                 
                 output_text = response.choices[0].message.content
                 
@@ -685,6 +605,8 @@ with tab1:
                 # Show more detailed error information
                 st.error(f"Error details: {str(e)}")
 
+    prompt_cache_metrics.render_panel()
+
 # ---- IMAGE GENERATOR TAB ----
 with tab2:
     st.subheader("Image Generation Details")
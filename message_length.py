@@ -0,0 +1,93 @@
+# message_length.py
+#
+# Server-side measurements for generated campaign messages. The model's own
+# `length` and `placeholders` fields are unreliable, so they are recomputed
+# here from `body`: real character counts per channel, SMS encoding (GSM-7
+# vs UCS-2) and segment counts, {{placeholder}} extraction and a maxLength
+# check.
+
+import math
+import re
+
+# Hard per-channel caps (from the system prompt's channel rules)
+CHANNEL_MAX_LENGTH = {
+    "whatsapp": 1024,
+    "sms": 1024,
+    "viber": 1000,
+}
+
+# GSM 03.38 basic character set (one septet each) and the extension table
+# (escape + septet, so two units each).
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+
+# (single-segment limit, per-segment limit once concatenated)
+SMS_LIMITS = {
+    "GSM-7": (160, 153),
+    "UCS-2": (70, 67),
+}
+
+PLACEHOLDER_PATTERN = re.compile(r"\{\{\s*[A-Za-z0-9_.\-]+\s*\}\}")
+
+
+def sms_encoding(text: str) -> str:
+    """GSM-7 if every character is in the GSM alphabet, otherwise UCS-2."""
+    if all(c in GSM7_BASIC or c in GSM7_EXTENDED for c in text):
+        return "GSM-7"
+    return "UCS-2"
+
+
+def sms_units(text: str, encoding: str) -> int:
+    """Septets for GSM-7 (extension chars count twice), UTF-16 code units for UCS-2."""
+    if encoding == "GSM-7":
+        return sum(2 if c in GSM7_EXTENDED else 1 for c in text)
+    return len(text.encode("utf-16-le")) // 2
+
+
+def sms_segments(text: str) -> dict:
+    """Encoding, unit count and number of SMS segments a body will be billed as."""
+    encoding = sms_encoding(text)
+    units = sms_units(text, encoding)
+    single, multi = SMS_LIMITS[encoding]
+    segments = 1 if units <= single else math.ceil(units / multi)
+    return {"encoding": encoding, "units": units, "segments": segments}
+
+
+def extract_placeholders(body: str) -> list:
+    """{{placeholders}} in order of first appearance, normalised to {{name}}."""
+    seen = []
+    for match in PLACEHOLDER_PATTERN.findall(body or ""):
+        name = "{{" + match.strip("{} ") + "}}"
+        if name not in seen:
+            seen.append(name)
+    return seen
+
+
+def effective_limit(channel: str, max_length: int = None) -> int:
+    """The stricter of the user's maxLength and the channel's hard cap."""
+    cap = CHANNEL_MAX_LENGTH.get(channel, 1024)
+    return min(int(max_length), cap) if max_length else cap
+
+
+def measure(output: dict, channel: str, max_length: int = None) -> dict:
+    """
+    Overwrite `length` and `placeholders` on a campaign output with values
+    computed from its body, and return a report with the limit check (plus
+    encoding/segments for SMS).
+    """
+    body = output.get("body", "") or ""
+    output["length"] = len(body)
+    output["placeholders"] = extract_placeholders(body)
+
+    limit = effective_limit(channel, max_length)
+    report = {
+        "length": output["length"],
+        "limit": limit,
+        "over_limit": output["length"] > limit,
+    }
+    if channel == "sms":
+        report.update(sms_segments(body))
+    return report
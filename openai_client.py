@@ -0,0 +1,37 @@
+# openai_client.py
+#
+# One OpenAI client per process (per API key), shared by every Streamlit
+# session and rerun via st.cache_resource. The client owns an explicitly
+# sized httpx connection pool, so chat and image calls reuse warm TLS
+# connections instead of building a new client on every interaction.
+
+import httpx
+import streamlit as st
+from openai import OpenAI
+
+MAX_CONNECTIONS = 50
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 60  # seconds an idle pooled connection is kept open
+
+# Generous read timeout for long completions, short connect timeout so a
+# network blip fails fast instead of hanging the script thread.
+TIMEOUT = httpx.Timeout(120.0, connect=5.0)
+MAX_RETRIES = 2
+
+
+@st.cache_resource(show_spinner=False)
+def _build_client(api_key: str) -> OpenAI:
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=TIMEOUT,
+    )
+    return OpenAI(api_key=api_key, http_client=http_client, timeout=TIMEOUT, max_retries=MAX_RETRIES)
+
+
+def get_openai_client() -> OpenAI:
+    """Shared OpenAI client for the key in st.secrets (rotating the key builds a new one)."""
+    return _build_client(st.secrets["OPENAI_API_KEY"])
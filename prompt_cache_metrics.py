@@ -0,0 +1,64 @@
+# prompt_cache_metrics.py
+#
+# Message layout and accounting for OpenAI's automatic prompt caching. The
+# provider caches the longest previously-seen prefix (from 1024 tokens up),
+# so every campaign request is built with the system prompt first and
+# byte-identical, and all per-request content after it. Each response's
+# usage.prompt_tokens_details.cached_tokens is recorded process-wide so the
+# hit rate can be shown on a metrics panel.
+
+import threading
+
+import streamlit as st
+
+_totals = {}
+_lock = threading.Lock()
+
+
+def build_messages(system_prompt: str, turns) -> list:
+    """
+    Stable-prefix message list: the given system prompt (not a per-session
+    copy, which could drift) followed by the non-system turns in order.
+    """
+    return [{"role": "system", "content": system_prompt}] + [t for t in turns if t.get("role") != "system"]
+
+
+def record_usage(usage, kind: str = "chat"):
+    """Accumulate prompt, cached and completion tokens from a response's usage."""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+    with _lock:
+        totals = _totals.setdefault(kind, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+        totals["requests"] += 1
+        totals["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+        totals["cached_tokens"] += cached
+        totals["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+
+def snapshot() -> dict:
+    """Copy of the per-kind totals, each with its cache hit rate."""
+    with _lock:
+        result = {kind: dict(totals) for kind, totals in _totals.items()}
+    for totals in result.values():
+        prompt = totals["prompt_tokens"]
+        totals["hit_rate"] = totals["cached_tokens"] / prompt if prompt else 0.0
+    return result
+
+
+def render_panel():
+    """Expander with request counts and cached-token hit rates per request kind."""
+    stats = snapshot()
+    with st.expander("📊 Prompt cache metrics"):
+        if not stats:
+            st.caption("No completions recorded in this process yet.")
+            return
+        for kind, totals in sorted(stats.items()):
+            st.markdown(f"**{kind.capitalize()}**")
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Requests", totals["requests"])
+            col2.metric("Prompt tokens", totals["prompt_tokens"])
+            col3.metric("Cached tokens", totals["cached_tokens"])
+            col4.metric("Cache hit rate", f"{totals['hit_rate']:.0%}")
+        st.caption("Caching only applies once the shared prefix reaches 1024 tokens.")
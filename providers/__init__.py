@@ -0,0 +1,45 @@
+# providers/__init__.py
+#
+# Image generation backends behind one interface (see base.ImageProvider).
+# Entry points look a backend up by name:
+#
+#     img_bytes = providers.get_provider("flux-schnell").generate(prompt, seed=42)
+
+from .base import Capabilities, ImageProvider, Submission, metrics
+from .openai_images import DallE3Provider, GptImage1Provider
+from .replicate_models import FluxSchnellProvider, KontextMaxProvider, MultiImageKontextProvider
+
+# One stateless instance per backend, keyed by provider name
+PROVIDERS = {
+    provider.name: provider
+    for provider in (
+        FluxSchnellProvider(),
+        KontextMaxProvider(),
+        MultiImageKontextProvider(),
+        DallE3Provider(),
+        GptImage1Provider(),
+    )
+}
+
+
+def get_provider(name: str) -> ImageProvider:
+    """Look up a provider by name (e.g. "flux-schnell", "dall-e-3")."""
+    try:
+        return PROVIDERS[name]
+    except KeyError:
+        raise Exception(f"Unknown image provider '{name}'. Available: {', '.join(PROVIDERS)}")
+
+
+__all__ = [
+    "Capabilities",
+    "ImageProvider",
+    "Submission",
+    "PROVIDERS",
+    "get_provider",
+    "metrics",
+    "DallE3Provider",
+    "GptImage1Provider",
+    "FluxSchnellProvider",
+    "KontextMaxProvider",
+    "MultiImageKontextProvider",
+]
@@ -0,0 +1,165 @@
+# providers/base.py
+#
+# Common interface for image backends. A generation is four steps: submit
+# the request, wait for it to finish, download the output, and (if it is
+# abandoned) cancel it. submit() takes the call_scheduler slot and
+# download()/cancel() give it back. generate() runs the steps in order (after
+# a cache lookup, for backends that cache), wraps errors the same way for
+# every backend and records per-provider metrics, so every entry point gets
+# identical numbers.
+
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+
+import httpx
+import requests
+
+
+@dataclass(frozen=True)
+class Capabilities:
+    max_input_images: int = 0  # 0 = text-to-image only
+    sizes: tuple = ()  # accepted "WxH" sizes; empty = provider default / aspect ratio
+    supports_seed: bool = False
+    supports_transparency: bool = False
+    supports_cancel: bool = False  # abandoned generations are stopped (and stop billing) upstream
+
+
+@dataclass
+class Submission:
+    """A request handed to a provider; `data` is the provider's latest response."""
+    provider: str
+    model: str
+    id: str = None
+    status: str = "starting"
+    data: object = None
+    started_at: float = field(default_factory=time.monotonic)
+
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def _totals(name: str) -> dict:
+    return _metrics.setdefault(name, {"requests": 0, "failures": 0, "seconds": 0.0, "cache_hits": 0})
+
+
+def record_generation(name: str, seconds: float, ok: bool):
+    with _metrics_lock:
+        totals = _totals(name)
+        totals["requests"] += 1
+        totals["failures"] += 0 if ok else 1
+        totals["seconds"] += seconds
+
+
+def record_cache_hit(name: str):
+    """Count a result served from cache; kept out of requests and timings."""
+    with _metrics_lock:
+        _totals(name)["cache_hits"] += 1
+
+
+def metrics() -> dict:
+    """Copy of per-provider totals, each with its average (uncached) generation time."""
+    with _metrics_lock:
+        result = {name: dict(totals) for name, totals in _metrics.items()}
+    for totals in result.values():
+        totals["avg_seconds"] = totals["seconds"] / totals["requests"] if totals["requests"] else 0.0
+    return result
+
+
+class ImageProvider:
+    """Base class; subclasses implement submit/wait/download, and cancel when supported."""
+
+    name = ""
+    model = ""
+    service = ""  # call_scheduler provider name: "replicate" or "openai"
+    service_label = ""  # how the service is named in error messages
+    capabilities = Capabilities()
+
+    def submit(self, prompt: str, **options) -> Submission:
+        """Wait for a call_scheduler slot and start the request; the slot is held until download/cancel."""
+        raise NotImplementedError
+
+    def wait(self, submission: Submission) -> Submission:
+        """Block until the submission has finished; returns it updated."""
+        raise NotImplementedError
+
+    def download(self, submission: Submission) -> bytes:
+        """Output bytes of a finished submission; releases its slot."""
+        raise NotImplementedError
+
+    def cancel(self, submission: Submission) -> bool:
+        """Stop a running submission and release its slot; False if it could not be stopped."""
+        return False
+
+    def cached(self, prompt: str, **options):
+        """(cache_key, cached bytes or None) for a request; (None, None) when it is not cacheable."""
+        return None, None
+
+    def store(self, cache_key: str, img_bytes: bytes):
+        pass
+
+    def _generate(self, prompt: str, **options) -> bytes:
+        submission = self.submit(prompt, **options)
+        try:
+            submission = self.wait(submission)
+        except Exception:
+            self.cancel(submission)
+            raise
+        return self.download(submission)
+
+    async def _generate_async(self, prompt: str, **options) -> bytes:
+        # The steps block, so run them off the event loop
+        return await asyncio.to_thread(self._generate, prompt, **options)
+
+    def _error(self, e: Exception) -> Exception:
+        if isinstance(e, (requests.exceptions.RequestException, httpx.HTTPError)):
+            return Exception(f"{self.service_label} API request error: {e}")
+        return Exception(f"Image generation error: {e}")
+
+    def generate(self, prompt: str, **options) -> bytes:
+        """Submit, wait and download in one call; errors come back as readable Exceptions."""
+        try:
+            cache_key, img_bytes = self.cached(prompt, **options)
+        except Exception as e:
+            raise self._error(e)
+        if img_bytes:
+            record_cache_hit(self.name)
+            return img_bytes
+
+        started = time.monotonic()
+        ok = False
+        try:
+            img_bytes = self._generate(prompt, **options)
+            ok = True
+        except Exception as e:
+            raise self._error(e)
+        finally:
+            record_generation(self.name, time.monotonic() - started, ok)
+        if cache_key:
+            self.store(cache_key, img_bytes)
+        return img_bytes
+
+    async def generate_async(self, prompt: str, **options) -> bytes:
+        """generate() for coroutines; never blocks the calling event loop."""
+        try:
+            cache_key, img_bytes = await asyncio.to_thread(self.cached, prompt, **options)
+        except Exception as e:
+            raise self._error(e)
+        if img_bytes:
+            record_cache_hit(self.name)
+            return img_bytes
+
+        started = time.monotonic()
+        ok = False
+        try:
+            img_bytes = await self._generate_async(prompt, **options)
+            ok = True
+        except Exception as e:
+            raise self._error(e)
+        finally:
+            record_generation(self.name, time.monotonic() - started, ok)
+        if cache_key:
+            await asyncio.to_thread(self.store, cache_key, img_bytes)
+        return img_bytes
@@ -0,0 +1,60 @@
+# providers/openai_images.py
+#
+# OpenAI image models (DALL·E 3, gpt-image-1) behind the provider interface.
+# images.generate answers with the finished image, so submit does the work,
+# wait is a no-op and nothing can be cancelled. Outputs come back either as
+# base64 (gpt-image-1) or as a short-lived URL (DALL·E 3), which is fetched
+# over the shared pooled session with the same size cap and retries as
+# Replicate outputs.
+
+import base64
+
+import call_scheduler
+import image_download
+import replicate_client
+import replicate_resilience
+from openai_client import get_openai_client
+
+from .base import Capabilities, ImageProvider, Submission
+
+
+class OpenAIImageProvider(ImageProvider):
+    service = "openai"
+    service_label = "OpenAI"
+    default_params = {}
+
+    def submit(self, prompt: str, **options) -> Submission:
+        params = {**self.default_params, **{k: v for k, v in options.items() if v is not None}}
+        if "size" in params and self.capabilities.sizes and params["size"] not in self.capabilities.sizes:
+            raise ValueError(f"{self.model} does not support size {params['size']}")
+        # images.generate returns the finished image, so the slot covers the whole call
+        with call_scheduler.slot(self.service, self.model):
+            response = get_openai_client().images.generate(model=self.model, prompt=prompt, **params)
+        return Submission(self.name, self.model, status="succeeded", data=response)
+
+    def wait(self, submission: Submission) -> Submission:
+        return submission
+
+    def download(self, submission: Submission) -> bytes:
+        image = submission.data.data[0]
+        if getattr(image, "b64_json", None):
+            return base64.b64decode(image.b64_json)
+
+        def fetch():
+            return image_download.download_bytes(replicate_client.get_session(), image.url)
+
+        return replicate_resilience.call(fetch, replicate_resilience.DOWNLOAD_POLICY, provider=self.service)
+
+
+class DallE3Provider(OpenAIImageProvider):
+    name = "dall-e-3"
+    model = "dall-e-3"
+    capabilities = Capabilities(sizes=("1024x1024", "1792x1024", "1024x1792"))
+    default_params = {"size": "1024x1024", "quality": "standard", "n": 1}
+
+
+class GptImage1Provider(OpenAIImageProvider):
+    name = "gpt-image-1"
+    model = "gpt-image-1"
+    capabilities = Capabilities(sizes=("1024x1024", "1536x1024", "1024x1536", "auto"), supports_transparency=True)
+    default_params = {"size": "1024x1024", "quality": "low"}
@@ -0,0 +1,123 @@
+# providers/replicate_models.py
+#
+# Replicate-hosted models (Flux Schnell, Kontext Max, multi-image Kontext).
+# Each provider builds its model input; submit, wait, download and cancel are
+# replicate_client's run steps (start_prediction, await_prediction,
+# download_run, cancel_run), the same ones run_prediction uses, so they keep
+# the scheduler slot, webhook/blocking-wait shortcuts, live-prediction
+# tracking and cancel-on-abandon. The async path uses replicate_async's
+# run_prediction. Deterministic requests (fixed seed, use_cache=True) are
+# served from image_cache.
+
+import asyncio
+
+import image_cache
+import replicate_async
+import replicate_client
+import replicate_files
+
+from .base import Capabilities, ImageProvider, Submission
+
+
+class ReplicateProvider(ImageProvider):
+    service = "replicate"
+    service_label = "Replicate"
+
+    def build_input(self, prompt: str, **options) -> dict:
+        raise NotImplementedError
+
+    def submit(self, prompt: str, **options) -> Submission:
+        run = replicate_client.start_prediction(self.model, self.build_input(prompt, **options))
+        prediction = run.prediction
+        return Submission(self.name, self.model, id=prediction["id"], status=prediction.get("status"), data=run)
+
+    def wait(self, submission: Submission) -> Submission:
+        prediction = replicate_client.await_prediction(submission.data)
+        submission.status = prediction.get("status")
+        return submission
+
+    def download(self, submission: Submission) -> bytes:
+        return replicate_client.download_run(submission.data)
+
+    def cancel(self, submission: Submission) -> bool:
+        return replicate_client.cancel_run(submission.data)
+
+    def cached(self, prompt: str, **options):
+        # Only seeded requests repeat exactly; building their input is cheap (no uploads)
+        if not (options.get("use_cache") and self.capabilities.supports_seed and options.get("seed") is not None):
+            return None, None
+        cache_key = image_cache.cache_key(self.model, self.build_input(prompt, **options))
+        return cache_key, image_cache.get(cache_key)
+
+    def store(self, cache_key: str, img_bytes: bytes):
+        image_cache.put(cache_key, img_bytes)
+
+    async def _generate_async(self, prompt: str, **options) -> bytes:
+        # Uploads and Pillow work block: keep them off the shared loop
+        model_input = await asyncio.to_thread(self.build_input, prompt, **options)
+        return await replicate_async.run_prediction(self.model, model_input)
+
+
+class FluxSchnellProvider(ReplicateProvider):
+    name = "flux-schnell"
+    model = "black-forest-labs/flux-schnell"
+    capabilities = Capabilities(supports_seed=True, supports_cancel=True)
+
+    def build_input(self, prompt: str, seed: int = None, **options) -> dict:
+        model_input = {"prompt": prompt}
+        if seed is not None:
+            model_input["seed"] = int(seed)
+        return model_input
+
+
+class KontextMaxProvider(ReplicateProvider):
+    """Single reference image; pass image_bytes (+ mime_type) or an already uploaded input_image_uri."""
+    name = "kontext-max"
+    model = "black-forest-labs/flux-kontext-max"
+    capabilities = Capabilities(max_input_images=1, supports_cancel=True)
+
+    def build_input(self, prompt: str, input_image_uri: str = None, image_bytes: bytes = None,
+                    mime_type: str = "image/png", **options) -> dict:
+        if input_image_uri is None:
+            if not image_bytes:
+                raise ValueError("An input image is required.")
+            input_image_uri = replicate_files.input_url(image_bytes, self.model, mime_type)
+        return {
+            "prompt": prompt,
+            "input_image": input_image_uri,
+            "output_format": "jpg",
+        }
+
+
+class MultiImageKontextProvider(ReplicateProvider):
+    """Up to four reference images (file-like objects or bytes) combined per the prompt."""
+    name = "multi-image-kontext"
+    model = "flux-kontext-apps/multi-image-list"
+    capabilities = Capabilities(max_input_images=4, supports_cancel=True)
+
+    def build_input(self, prompt: str, image_files=None, aspect_ratio: str = "match_input_image", **options) -> dict:
+        if not prompt or not prompt.strip():
+            raise ValueError("Prompt is required.")
+        if not image_files:
+            raise ValueError("At least one input image is required.")
+
+        image_urls = []
+        for f in image_files[:self.capabilities.max_input_images]:
+            if hasattr(f, "read"):
+                if hasattr(f, "seek"):
+                    f.seek(0)
+                data = f.read()
+                if hasattr(f, "seek"):
+                    f.seek(0)
+            else:
+                data = f
+            # Normalise and upload once (falls back to a base64 data URL)
+            image_urls.append(replicate_files.input_url(data, self.model, getattr(f, "type", "image/png")))
+
+        return {
+            "prompt": prompt.strip(),
+            "input_images": image_urls,
+            "aspect_ratio": aspect_ratio,
+            "output_format": "png",
+            "safety_tolerance": 2,
+        }
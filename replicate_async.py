@@ -0,0 +1,259 @@
+# replicate_async.py
+#
+# asyncio/httpx counterpart of replicate_client. A single event loop runs in a
+# daemon thread for the whole process and owns one pooled httpx.AsyncClient,
+# so any Streamlit session can fan out several predictions at once and wait
+# for all of them in roughly the time of the slowest one.
+#
+# Callers are synchronous (Streamlit script, job threads); use
+# as_completed_sync() to hand coroutines to the background loop and consume
+# their results as they finish.
+
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+import time
+
+import httpx
+
+import call_scheduler
+import image_download
+import replicate_client
+import replicate_polling
+import replicate_resilience
+import replicate_webhooks
+
+# Mirrors replicate_client's pool sizing and timeouts
+LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=replicate_client.POOL_MAXSIZE)
+TIMEOUT = httpx.Timeout(replicate_client.API_TIMEOUT[1], connect=replicate_client.API_TIMEOUT[0])
+DOWNLOAD_TIMEOUT = httpx.Timeout(image_download.DOWNLOAD_TIMEOUT[1], connect=image_download.DOWNLOAD_TIMEOUT[0])
+
+_loop = None
+_client = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the process-wide background event loop, starting it on first use."""
+    global _loop
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="replicate-async", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def get_client() -> httpx.AsyncClient:
+    """Shared AsyncClient; only ever used from the background loop."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(limits=LIMITS, timeout=TIMEOUT)
+    return _client
+
+
+def _in_caller_context(coro):
+    """
+    Wrap a coroutine so it runs with the calling thread's context variables
+    (session id for call_scheduler, cancel event for replicate_client);
+    tasks on the loop thread would not otherwise inherit them.
+    """
+    context = contextvars.copy_context()
+
+    async def _run():
+        for var, value in context.items():
+            var.set(value)
+        return await coro
+
+    return _run()
+
+
+def as_completed_sync(coros):
+    """
+    Submit coroutines concurrently and yield (index, result) as each one
+    finishes, so the caller can render results progressively. A failed
+    coroutine yields its exception object as the result.
+    """
+    loop = get_loop()
+    futures = {asyncio.run_coroutine_threadsafe(_in_caller_context(coro), loop): i for i, coro in enumerate(coros)}
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            yield futures[future], future.result()
+        except Exception as e:
+            yield futures[future], e
+
+
+async def create_prediction(
+    model_slug: str,
+    model_input: dict,
+    wait_seconds: int = None,
+    webhook: str = None,
+) -> dict:
+    """Async version of replicate_client.create_prediction."""
+    headers = replicate_client.api_headers()
+    timeout = TIMEOUT
+    if wait_seconds is None:
+        wait_seconds = replicate_client.prefer_wait_seconds(model_slug)
+    if wait_seconds:
+        headers = {**headers, "Prefer": f"wait={int(wait_seconds)}"}
+        timeout = httpx.Timeout(max(TIMEOUT.read, wait_seconds + 10), connect=TIMEOUT.connect)
+    payload = {"input": model_input}
+    if webhook:
+        payload["webhook"] = webhook
+        payload["webhook_events_filter"] = ["completed"]
+
+    async def attempt():
+        resp = await get_client().post(
+            f"{replicate_client.API_BASE}/models/{model_slug}/predictions",
+            headers=headers,
+            json=payload,
+            timeout=timeout,
+        )
+        raise_for_status(resp)
+        return resp.json()
+
+    return await replicate_resilience.call_async(attempt, replicate_resilience.CREATE_POLICY)
+
+
+def raise_for_status(resp):
+    """Async-side counterpart of replicate_client.raise_for_status."""
+    if resp.status_code == 429:
+        raise httpx.HTTPStatusError(
+            "Replicate is rate limiting requests right now; please try again in a minute.",
+            request=resp.request,
+            response=resp,
+        )
+    resp.raise_for_status()
+
+
+async def get_prediction(prediction_id: str) -> dict:
+    """Async version of replicate_client.get_prediction."""
+
+    async def attempt():
+        resp = await get_client().get(
+            f"{replicate_client.API_BASE}/predictions/{prediction_id}",
+            headers=replicate_client.api_headers(),
+        )
+        raise_for_status(resp)
+        return resp.json()
+
+    return await replicate_resilience.call_async(attempt, replicate_resilience.POLL_POLICY)
+
+
+async def download_output(url: str, max_bytes: int = image_download.MAX_DOWNLOAD_BYTES) -> bytes:
+    """Async version of replicate_client.download_output."""
+
+    async def fetch():
+        return await image_download.download_bytes_async(get_client(), url, max_bytes, timeout=DOWNLOAD_TIMEOUT)
+
+    return await replicate_resilience.call_async(
+        lambda: replicate_resilience.hedged_async(fetch), replicate_resilience.DOWNLOAD_POLICY
+    )
+
+
+async def cancel_prediction(prediction_id: str) -> bool:
+    """Async version of replicate_client.cancel_prediction."""
+    try:
+        resp = await get_client().post(
+            f"{replicate_client.API_BASE}/predictions/{prediction_id}/cancel",
+            headers=replicate_client.api_headers(),
+        )
+        resp.raise_for_status()
+    except httpx.HTTPError:
+        return False
+    return True
+
+
+async def wait_for_prediction(prediction: dict, model_slug: str, started_at: float) -> dict:
+    """Poll on the model's adaptive schedule without blocking the event loop."""
+    profile = replicate_polling.get_profile(model_slug)
+    deadline = started_at + profile.max_wait
+
+    for delay in replicate_polling.poll_delays(model_slug):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        await asyncio.sleep(min(delay, remaining))
+        if replicate_client.cancel_requested():
+            raise Exception("Generation was cancelled")
+
+        status_data = await get_prediction(prediction["id"])
+        replicate_client.raise_if_failed(status_data)
+        if status_data["status"] == "succeeded":
+            replicate_polling.record_completion(model_slug, time.monotonic() - started_at)
+            return status_data
+
+    raise Exception(f"Generation timed out after {int(profile.max_wait)} seconds")
+
+
+async def wait_for_webhook(receiver, prediction: dict, model_slug: str, started_at: float) -> dict:
+    """
+    Await the webhook receiver's Future, checking for cancellation every
+    CANCEL_CHECK_INTERVAL seconds; one status GET if it never arrives.
+    """
+    max_wait = replicate_polling.get_profile(model_slug).max_wait
+    deadline = started_at + max_wait
+    delivered = asyncio.wrap_future(receiver.expect(prediction["id"]))
+    try:
+        while not delivered.done():
+            if replicate_client.cancel_requested():
+                raise Exception("Generation was cancelled")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.wait({delivered}, timeout=min(replicate_webhooks.CANCEL_CHECK_INTERVAL, remaining))
+        if delivered.done():
+            finished = delivered.result()
+        else:
+            finished = await get_prediction(prediction["id"])
+            if finished.get("status") not in replicate_webhooks.TERMINAL_STATUSES:
+                raise Exception(f"Generation timed out after {int(max_wait)} seconds")
+    finally:
+        receiver.forget(prediction["id"])
+
+    replicate_client.raise_if_failed(finished)
+    replicate_polling.record_completion(model_slug, time.monotonic() - started_at)
+    return finished
+
+
+async def run_prediction(
+    model_slug: str,
+    model_input: dict,
+    wait_seconds: int = None,
+) -> bytes:
+    """Async version of replicate_client.run_prediction."""
+    receiver = replicate_client.webhook_receiver()
+    ticket = await call_scheduler.acquire_async("replicate", model_slug)
+    try:
+        if replicate_client.cancel_requested():
+            raise Exception("Generation was cancelled")
+        started_at = time.monotonic()
+        prediction = await create_prediction(
+            model_slug, model_input, wait_seconds=wait_seconds, webhook=receiver.url if receiver else None
+        )
+        session = replicate_client.track(prediction["id"])
+        try:
+            if replicate_client.cancel_requested():
+                raise Exception("Generation was cancelled")
+            replicate_client.raise_if_failed(prediction)
+
+            if replicate_client.is_finished(prediction):
+                replicate_polling.record_completion(model_slug, time.monotonic() - started_at)
+                finished = prediction
+            elif receiver:
+                finished = await wait_for_webhook(receiver, prediction, model_slug, started_at)
+            else:
+                finished = await wait_for_prediction(prediction, model_slug, started_at)
+        except BaseException:
+            # Includes asyncio.CancelledError when the awaiting task is cancelled
+            if prediction.get("status") not in replicate_webhooks.TERMINAL_STATUSES:
+                await asyncio.shield(cancel_prediction(prediction["id"]))
+            raise
+        finally:
+            replicate_client.untrack(prediction["id"], session)
+
+        return await download_output(replicate_client.output_url(finished))
+    finally:
+        call_scheduler.release(ticket)
@@ -0,0 +1,380 @@
+# replicate_client.py
+#
+# Shared Replicate HTTP client. One keep-alive requests.Session is created per
+# process (module globals survive Streamlit reruns and are shared by every
+# browser session), so prediction create, status polls and output downloads
+# all reuse pooled TCP/TLS connections instead of paying a handshake each time.
+
+import contextvars
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+import call_scheduler
+import image_download
+import replicate_polling
+import replicate_resilience
+import replicate_webhooks
+
+API_BASE = "https://api.replicate.com/v1"
+
+# Connection pool sizing: one pool per host (API + delivery CDN), each able to
+# hold enough sockets for concurrent sessions without blocking.
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 32
+
+# (connect, read) timeouts in seconds for API calls
+API_TIMEOUT = (5, 60)
+
+# Seconds Replicate may hold the create request open ("Prefer: wait=N", 1-60)
+# before answering. Short jobs come back finished in the create response; only
+# longer ones fall back to polling. 0 disables the blocking-wait mode. The
+# wait counts towards the model's max_wait, so it is capped per model at
+# half of that (see prefer_wait_seconds) to leave polling real time.
+PREFER_WAIT_SECONDS = 60
+
+# Webhook mode is opt-in: set REPLICATE_WEBHOOK_URL in secrets to the public
+# URL that reaches the local receiver (REPLICATE_WEBHOOK_PORT, default 8765),
+# and REPLICATE_WEBHOOK_SECRET to the signing secret; deliveries are only
+# accepted with a valid signature, so without the secret webhooks stay off.
+DEFAULT_WEBHOOK_PORT = 8765
+
+# Set by whoever runs predictions on a session's behalf (job_manager); once
+# the event is set, no new predictions start and live ones are cancelled.
+CANCEL_EVENT = contextvars.ContextVar("replicate_cancel_event", default=None)
+
+_session = None
+_api_headers = None
+_lock = threading.Lock()
+
+# session id -> ids of predictions created for it and not yet finished
+_live = {}
+_live_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide pooled session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def api_headers() -> dict:
+    """
+    Auth headers for api.replicate.com, built once per process.
+    Kept off the session itself so the token is never sent to the output CDN.
+    """
+    global _api_headers
+    if _api_headers is None:
+        token = st.secrets["REPLICATE_API_TOKEN"]
+        _api_headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        }
+    return _api_headers
+
+
+def webhook_receiver():
+    """
+    Return the local webhook receiver when webhook mode is configured, else
+    None. Without REPLICATE_WEBHOOK_SECRET webhook mode stays off (polling is
+    used), since the public receiver must not accept unsigned deliveries.
+    """
+    public_url = st.secrets.get("REPLICATE_WEBHOOK_URL")
+    if not public_url or not st.secrets.get("REPLICATE_WEBHOOK_SECRET"):
+        return None
+    return replicate_webhooks.get_receiver(
+        port=int(st.secrets.get("REPLICATE_WEBHOOK_PORT", DEFAULT_WEBHOOK_PORT)),
+        secret=st.secrets.get("REPLICATE_WEBHOOK_SECRET"),
+        public_url=public_url,
+    )
+
+
+def prefer_wait_seconds(model_slug: str) -> int:
+    """Blocking-wait window for a model: PREFER_WAIT_SECONDS, at most half its max_wait."""
+    max_wait = replicate_polling.get_profile(model_slug).max_wait
+    return int(min(PREFER_WAIT_SECONDS, max_wait / 2))
+
+
+def create_prediction(
+    model_slug: str,
+    model_input: dict,
+    wait_seconds: int = None,
+    webhook: str = None,
+) -> dict:
+    """
+    Start a prediction on an official model and return the prediction JSON.
+    With wait_seconds > 0 the API blocks up to that long (default: the
+    model's prefer_wait_seconds), so the returned prediction may already be
+    finished. `webhook` asks Replicate to POST the
+    completed prediction to that URL.
+    """
+    headers = api_headers()
+    timeout = API_TIMEOUT
+    if wait_seconds is None:
+        wait_seconds = prefer_wait_seconds(model_slug)
+    if wait_seconds:
+        headers = {**headers, "Prefer": f"wait={int(wait_seconds)}"}
+        timeout = (API_TIMEOUT[0], max(API_TIMEOUT[1], wait_seconds + 10))
+    payload = {"input": model_input}
+    if webhook:
+        payload["webhook"] = webhook
+        payload["webhook_events_filter"] = ["completed"]
+
+    def attempt():
+        resp = get_session().post(
+            f"{API_BASE}/models/{model_slug}/predictions",
+            headers=headers,
+            json=payload,
+            timeout=timeout,
+        )
+        raise_for_status(resp)
+        return resp.json()
+
+    return replicate_resilience.call(attempt, replicate_resilience.CREATE_POLICY)
+
+
+def raise_for_status(resp):
+    """raise_for_status with a readable message when Replicate is rate limiting us."""
+    if resp.status_code == 429:
+        raise requests.exceptions.HTTPError(
+            "Replicate is rate limiting requests right now; please try again in a minute.", response=resp
+        )
+    resp.raise_for_status()
+
+
+def cancel_prediction(prediction_id: str) -> bool:
+    """Ask Replicate to stop a prediction. Best effort: returns False if the request failed."""
+    try:
+        resp = get_session().post(
+            f"{API_BASE}/predictions/{prediction_id}/cancel",
+            headers=api_headers(),
+            timeout=API_TIMEOUT,
+        )
+        resp.raise_for_status()
+    except requests.exceptions.RequestException:
+        return False
+    return True
+
+
+def cancel_requested() -> bool:
+    event = CANCEL_EVENT.get()
+    return event is not None and event.is_set()
+
+
+def track(prediction_id: str, session: str = None) -> str:
+    """Record a live prediction under the current session; returns the session id used."""
+    session = session or call_scheduler.current_session() or ""
+    with _live_lock:
+        _live.setdefault(session, set()).add(prediction_id)
+    return session
+
+
+def untrack(prediction_id: str, session: str):
+    with _live_lock:
+        ids = _live.get(session)
+        if ids:
+            ids.discard(prediction_id)
+            if not ids:
+                del _live[session]
+
+
+def live_predictions(session: str) -> set:
+    with _live_lock:
+        return set(_live.get(session, ()))
+
+
+def cancel_predictions(prediction_ids) -> int:
+    """Cancel the given predictions one by one; returns how many cancel requests succeeded."""
+    return sum(cancel_prediction(prediction_id) for prediction_id in prediction_ids)
+
+
+
+def is_finished(prediction: dict) -> bool:
+    """True when a prediction already succeeded and carries its output."""
+    return prediction.get("status") == "succeeded" and bool(prediction.get("output"))
+
+
+def get_prediction(prediction_id: str) -> dict:
+    """Fetch the current state of a prediction (transient failures are retried)."""
+
+    def attempt():
+        resp = get_session().get(
+            f"{API_BASE}/predictions/{prediction_id}",
+            headers=api_headers(),
+            timeout=API_TIMEOUT,
+        )
+        raise_for_status(resp)
+        return resp.json()
+
+    return replicate_resilience.call(attempt, replicate_resilience.POLL_POLICY)
+
+
+def output_url(prediction: dict) -> str:
+    """Pick the first image URL out of a succeeded prediction's output."""
+    outputs = prediction.get("output")
+    if isinstance(outputs, list) and len(outputs) > 0:
+        return outputs[0]
+    if isinstance(outputs, str):
+        return outputs
+    raise Exception("No valid output URL found")
+
+
+def download_output(url: str, max_bytes: int = image_download.MAX_DOWNLOAD_BYTES) -> bytes:
+    """
+    Stream a prediction output over the pooled session, capped at max_bytes.
+    Retried on transient failures and hedged when slower than usual.
+    """
+
+    def fetch(stop):
+        return image_download.download_bytes(get_session(), url, max_bytes, stop=stop)
+
+    return replicate_resilience.call(
+        lambda: replicate_resilience.hedged(fetch), replicate_resilience.DOWNLOAD_POLICY
+    )
+
+
+def raise_if_failed(prediction: dict):
+    if prediction.get("status") in ("failed", "canceled"):
+        error_msg = prediction.get("error") or "Unknown error"
+        raise Exception(f"Prediction failed: {error_msg}")
+
+
+def wait_for_prediction(prediction: dict, model_slug: str, started_at: float = None) -> dict:
+    """Poll a prediction on the model's adaptive schedule until it succeeds."""
+    return replicate_polling.poll_until_done(
+        prediction, model_slug, get_prediction, started_at=started_at, cancelled=cancel_requested
+    )
+
+
+def wait_for_webhook(receiver, prediction: dict, model_slug: str, started_at: float) -> dict:
+    """
+    Block on the webhook for a prediction instead of polling. If it does not
+    arrive within the model's cap, one status GET decides the outcome.
+    """
+    max_wait = replicate_polling.get_profile(model_slug).max_wait
+    remaining = max(0.0, started_at + max_wait - time.monotonic())
+    try:
+        finished = receiver.wait(prediction["id"], timeout=remaining, cancelled=cancel_requested)
+    except TimeoutError:
+        finished = get_prediction(prediction["id"])
+        if finished.get("status") not in replicate_webhooks.TERMINAL_STATUSES:
+            raise Exception(f"Generation timed out after {int(max_wait)} seconds")
+
+    raise_if_failed(finished)
+    replicate_polling.record_completion(model_slug, time.monotonic() - started_at)
+    return finished
+
+
+@dataclass
+class PredictionRun:
+    """A prediction started by start_prediction; holds its call_scheduler slot until release_run."""
+    model_slug: str
+    prediction: dict
+    ticket: call_scheduler.Ticket
+    session: str
+    started_at: float
+    receiver: object = None  # webhook receiver, when webhook mode is on
+    released: bool = False
+
+
+def start_prediction(model_slug: str, model_input: dict, wait_seconds: int = None) -> PredictionRun:
+    """
+    Wait until call_scheduler admits the call (provider rate, model
+    concurrency, session fairness), then create and track the prediction.
+    The slot stays taken until release_run (download_run and cancel_run
+    release it).
+    """
+    receiver = webhook_receiver()
+    ticket = call_scheduler.acquire("replicate", model_slug)
+    try:
+        if cancel_requested():
+            raise Exception("Generation was cancelled")
+        started_at = time.monotonic()
+        prediction = create_prediction(
+            model_slug, model_input, wait_seconds=wait_seconds, webhook=receiver.url if receiver else None
+        )
+    except BaseException:
+        call_scheduler.release(ticket)
+        raise
+    return PredictionRun(model_slug, prediction, ticket, track(prediction["id"]), started_at, receiver)
+
+
+def await_prediction(run: PredictionRun) -> dict:
+    """
+    Wait for the run's prediction to succeed and return it. A prediction the
+    blocking create already finished returns at once; otherwise we wait on
+    the webhook receiver when configured, and poll as the last resort. If
+    the wait is abandoned (failure, timeout, cancellation) the prediction is
+    cancelled on Replicate and the slot released.
+    """
+    try:
+        if cancel_requested():
+            raise Exception("Generation was cancelled")
+        raise_if_failed(run.prediction)
+
+        if is_finished(run.prediction):
+            replicate_polling.record_completion(run.model_slug, time.monotonic() - run.started_at)
+        elif run.receiver:
+            run.prediction = wait_for_webhook(run.receiver, run.prediction, run.model_slug, run.started_at)
+        else:
+            run.prediction = wait_for_prediction(run.prediction, run.model_slug, started_at=run.started_at)
+    except Exception:
+        # Timed out, cancelled or broken off: stop the GPU time we would still pay for
+        cancel_run(run)
+        raise
+    untrack(run.prediction["id"], run.session)
+    return run.prediction
+
+
+def download_run(run: PredictionRun) -> bytes:
+    """Download the finished run's output, then release its slot."""
+    try:
+        return download_output(output_url(run.prediction))
+    finally:
+        release_run(run)
+
+
+def cancel_run(run: PredictionRun) -> bool:
+    """
+    Cancel the run's prediction on Replicate unless it already finished, and
+    release its slot. Returns whether a cancel request went through.
+    """
+    try:
+        if run.released or run.prediction.get("status") in replicate_webhooks.TERMINAL_STATUSES:
+            return False
+        return cancel_prediction(run.prediction["id"])
+    finally:
+        release_run(run)
+
+
+def release_run(run: PredictionRun):
+    """Stop tracking the run and free its call_scheduler slot (safe to call twice)."""
+    run.released = True
+    untrack(run.prediction["id"], run.session)
+    call_scheduler.release(run.ticket)
+
+
+def run_prediction(model_slug: str, model_input: dict, wait_seconds: int = None) -> bytes:
+    """
+    Create a prediction and return the output image bytes: start_prediction,
+    await_prediction and download_run in turn. A prediction abandoned on the
+    way (timeout, cancellation) is cancelled on Replicate.
+    """
+    run = start_prediction(model_slug, model_input, wait_seconds=wait_seconds)
+    try:
+        await_prediction(run)
+        return download_run(run)
+    finally:
+        release_run(run)
@@ -0,0 +1,124 @@
+# replicate_files.py
+#
+# Uploads prediction input images to Replicate's files API once and reuses
+# the returned URL, instead of inlining megabytes of base64 into every
+# request. Uploads are deduplicated by a hash of the (already normalised)
+# bytes, process-wide, so chaining "Edit This Image" on the same output or
+# re-running Combine with the same set of photos only sends a short URL.
+# input_url() also remembers the URL under a hash of the raw source bytes
+# and the model, so a repeated source skips Pillow normalisation entirely.
+# Entries are dropped a little before Replicate expires the file; if the
+# upload itself fails the caller falls back to a data: URI.
+
+import base64
+import hashlib
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+import image_preprocess
+import replicate_client
+
+FILES_URL = f"{replicate_client.API_BASE}/files"
+
+# Used when the response has no parseable expires_at (Replicate keeps
+# uploaded files for about a day).
+DEFAULT_TTL_SECONDS = 23 * 60 * 60
+# Stop reusing a URL this long before it expires, so a queued prediction
+# never references a file that has just been deleted.
+EXPIRY_MARGIN_SECONDS = 15 * 60
+MAX_ENTRIES = 500
+
+# content hash (or source key, see input_url) -> (url, expires_at as epoch seconds)
+_uploads = {}
+_lock = threading.Lock()
+
+_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif"}
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _expiry(file_json: dict) -> float:
+    expires_at = file_json.get("expires_at")
+    if expires_at:
+        try:
+            return datetime.fromisoformat(expires_at.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    return time.time() + DEFAULT_TTL_SECONDS
+
+
+def cached_url(digest: str):
+    """URL of a still-valid earlier upload of this content, or None."""
+    with _lock:
+        entry = _uploads.get(digest)
+        if entry and entry[1] - EXPIRY_MARGIN_SECONDS > time.time():
+            return entry[0]
+        _uploads.pop(digest, None)
+    return None
+
+
+def _remember(digest: str, url: str, expires_at: float):
+    with _lock:
+        now = time.time()
+        for key in [k for k, (_, exp) in _uploads.items() if exp - EXPIRY_MARGIN_SECONDS <= now]:
+            del _uploads[key]
+        while len(_uploads) >= MAX_ENTRIES:
+            del _uploads[min(_uploads, key=lambda k: _uploads[k][1])]
+        _uploads[digest] = (url, expires_at)
+
+
+def _cached_entry(key: str):
+    with _lock:
+        return _uploads.get(key)
+
+
+def upload(data: bytes, mime_type: str = "image/jpeg") -> str:
+    """Upload bytes to the files API (or reuse an earlier upload) and return the file URL."""
+    digest = content_hash(data)
+    url = cached_url(digest)
+    if url:
+        return url
+
+    # multipart body: let requests set its own Content-Type boundary
+    headers = {k: v for k, v in replicate_client.api_headers().items() if k != "Content-Type"}
+    filename = f"{digest[:16]}.{_EXTENSIONS.get(mime_type, 'bin')}"
+    resp = replicate_client.get_session().post(
+        FILES_URL,
+        headers=headers,
+        files={"content": (filename, data, mime_type)},
+        timeout=replicate_client.API_TIMEOUT,
+    )
+    resp.raise_for_status()
+    file_json = resp.json()
+    url = (file_json.get("urls") or {}).get("get")
+    if not url:
+        raise ValueError(f"Replicate file upload returned no URL: {file_json}")
+    _remember(digest, url, _expiry(file_json))
+    return url
+
+
+def input_url(data: bytes, model_slug: str = None, mime_type: str = "image/png") -> str:
+    """
+    Normalise an input image for the model and return a URL for it: a files
+    API URL when the upload works, otherwise an inline data: URI.
+    """
+    # Normalising depends on the model (target size), so the model is part of the key
+    source_key = f"source:{model_slug or ''}:{content_hash(data)}"
+    url = cached_url(source_key)
+    if url:
+        return url
+
+    data, mime_type = image_preprocess.normalize_image(data, model_slug, mime_type)
+    try:
+        url = upload(data, mime_type)
+    except (requests.exceptions.RequestException, ValueError):
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode()}"
+    entry = _cached_entry(content_hash(data))
+    if entry:
+        _remember(source_key, *entry)
+    return url
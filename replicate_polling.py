@@ -0,0 +1,117 @@
+# replicate_polling.py
+#
+# Adaptive polling engine for Replicate predictions. Each model has a latency
+# profile: poll quickly at first, back off exponentially with jitter, and give
+# up after a per-model cap. Observed completion times are recorded per model
+# and used to push the first poll out to roughly when the job usually ends.
+
+import random
+import statistics
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class LatencyProfile:
+    first_delay: float  # seconds before the first status check
+    max_delay: float  # ceiling for a single backoff step
+    multiplier: float = 1.6
+    jitter: float = 0.2  # +/- fraction applied to every delay
+    max_wait: float = 300  # total seconds before giving up
+
+
+DEFAULT_PROFILE = LatencyProfile(first_delay=1.0, max_delay=5.0)
+
+MODEL_PROFILES = {
+    # Usually done in seconds, but cold boots and queueing can take minutes
+    "black-forest-labs/flux-schnell": LatencyProfile(first_delay=0.3, max_delay=2.0, max_wait=300),
+    "black-forest-labs/flux-kontext-max": LatencyProfile(first_delay=2.0, max_delay=8.0),
+    "flux-kontext-apps/multi-image-list": LatencyProfile(first_delay=2.0, max_delay=8.0),
+}
+
+# How many recent completion times to keep per model, and how many are needed
+# before they start shaping the schedule.
+HISTORY_SIZE = 50
+MIN_SAMPLES = 5
+# First poll lands at this fraction of the median observed completion time
+TUNED_FIRST_FRACTION = 0.8
+
+_observed = {}
+_lock = threading.Lock()
+
+
+def get_profile(model_slug: str) -> LatencyProfile:
+    """Return the latency profile for a model, falling back to the default."""
+    return MODEL_PROFILES.get(model_slug, DEFAULT_PROFILE)
+
+
+def record_completion(model_slug: str, seconds: float):
+    """Record how long a prediction for this model took to finish."""
+    with _lock:
+        history = _observed.setdefault(model_slug, deque(maxlen=HISTORY_SIZE))
+        history.append(seconds)
+
+
+def observed_median(model_slug: str):
+    """Median observed completion time, or None until enough samples exist."""
+    with _lock:
+        history = list(_observed.get(model_slug, ()))
+    if len(history) < MIN_SAMPLES:
+        return None
+    return statistics.median(history)
+
+
+def first_delay(model_slug: str) -> float:
+    """Delay before the first poll, tuned from observed completion times."""
+    profile = get_profile(model_slug)
+    median = observed_median(model_slug)
+    if median is None:
+        return profile.first_delay
+    tuned = median * TUNED_FIRST_FRACTION
+    return min(max(tuned, profile.first_delay), profile.max_delay)
+
+
+def poll_delays(model_slug: str):
+    """Yield successive sleep intervals: fast early, then exponential backoff with jitter."""
+    profile = get_profile(model_slug)
+    delay = first_delay(model_slug)
+    while True:
+        spread = delay * profile.jitter
+        yield max(0.0, delay + random.uniform(-spread, spread))
+        delay = min(delay * profile.multiplier, profile.max_delay)
+
+
+def poll_until_done(prediction: dict, model_slug: str, fetch, started_at: float = None, cancelled=None) -> dict:
+    """
+    Poll `fetch(prediction_id)` on the model's schedule until the prediction
+    succeeds. Raises on failure, cancellation or when the model's cap is hit.
+    `started_at` (time.monotonic) lets time already spent in a blocking
+    create count towards the cap and the recorded completion time.
+    `cancelled()` is checked before every poll; once it returns True the
+    wait stops, even if cancelling on Replicate did not go through.
+    """
+    profile = get_profile(model_slug)
+    prediction_id = prediction["id"]
+    start_time = started_at if started_at is not None else time.monotonic()
+    deadline = start_time + profile.max_wait
+
+    for delay in poll_delays(model_slug):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(delay, remaining))
+        if cancelled and cancelled():
+            raise Exception("Generation was cancelled")
+
+        status_data = fetch(prediction_id)
+
+        if status_data["status"] == "succeeded":
+            record_completion(model_slug, time.monotonic() - start_time)
+            return status_data
+        if status_data["status"] in ("failed", "canceled"):
+            error_msg = status_data.get("error") or "Unknown error"
+            raise Exception(f"Prediction failed: {error_msg}")
+
+    raise Exception(f"Generation timed out after {int(profile.max_wait)} seconds")
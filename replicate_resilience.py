@@ -0,0 +1,236 @@
+# replicate_resilience.py
+#
+# Retry and hedging for the three stages of a Replicate prediction. Status
+# polls and output downloads are idempotent, so any transient failure is
+# retried with exponential backoff. Prediction creation is not: a read
+# timeout, a dropped connection or a 500/502/504 (often from a proxy giving
+# up on a long Prefer: wait) can arrive after the prediction was already
+# started and billed. Creates are therefore only retried when the request
+# did not take effect: connect failures, 429 (rate limited) and 503
+# (not accepting requests).
+#
+# Downloads can additionally be hedged: once enough download times have been
+# observed, a download still running past the p95 gets a second, identical
+# request to the CDN and whichever finishes first wins. The first request runs
+# on the caller's thread; only the second one uses the hedge pool.
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+import httpx
+import requests
+from urllib3.exceptions import NewConnectionError
+
+import call_scheduler
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Statuses that mean the request was rejected before any work was done
+REJECTED_STATUSES = frozenset({429, 503})
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int  # total tries, including the first
+    base_delay: float  # seconds before the first retry, doubled each time
+    max_delay: float = 10.0
+    jitter: float = 0.2  # +/- fraction applied to every delay
+    retry_ambiguous: bool = True  # retry failures where the request may have been processed
+    retry_statuses: frozenset = RETRY_STATUSES
+
+
+CREATE_POLICY = RetryPolicy(attempts=3, base_delay=2.0, retry_ambiguous=False, retry_statuses=REJECTED_STATUSES)
+POLL_POLICY = RetryPolicy(attempts=5, base_delay=0.5)
+DOWNLOAD_POLICY = RetryPolicy(attempts=4, base_delay=0.5)
+
+# Hedged downloads: off until HEDGE_MIN_SAMPLES downloads have been timed
+HEDGE_DOWNLOADS = True
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_HISTORY_SIZE = 200
+
+_download_times = deque(maxlen=HEDGE_HISTORY_SIZE)
+_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="download-hedge")
+
+
+def _response(exc):
+    return getattr(exc, "response", None)
+
+
+def _connect_failed(exc) -> bool:
+    """A requests ConnectionError raised before anything was sent (refused, DNS failure)."""
+    reason = exc.args[0] if exc.args else None
+    reason = getattr(reason, "reason", reason)  # urllib3 MaxRetryError wraps the cause
+    return isinstance(reason, NewConnectionError)  # includes NameResolutionError
+
+
+def classify(exc) -> str:
+    """
+    "status" for a retryable HTTP status, "safe" when the request never
+    reached the server, "ambiguous" when it may have, None if not transient.
+    """
+    response = _response(exc)
+    if isinstance(exc, (requests.exceptions.HTTPError, httpx.HTTPStatusError)):
+        return "status" if response is not None and response.status_code in RETRY_STATUSES else None
+    if isinstance(exc, (requests.exceptions.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return "safe"
+    if isinstance(exc, requests.exceptions.ConnectionError) and _connect_failed(exc):
+        return "safe"
+    if isinstance(exc, (requests.exceptions.RequestException, httpx.TransportError)):
+        return "ambiguous"
+    return None
+
+
+def should_retry(exc, policy: RetryPolicy) -> bool:
+    kind = classify(exc)
+    if kind == "status":
+        return _response(exc).status_code in policy.retry_statuses
+    return kind == "safe" or (kind == "ambiguous" and policy.retry_ambiguous)
+
+
+def retry_delay(exc, policy: RetryPolicy, attempt: int) -> float:
+    """Retry-After when the response carries one, else jittered exponential backoff."""
+    response = _response(exc)
+    delay = call_scheduler.retry_after(response.headers) if response is not None else None
+    if delay is None:
+        delay = min(policy.base_delay * 2 ** attempt, policy.max_delay)
+        delay *= random.uniform(1 - policy.jitter, 1 + policy.jitter)
+    return delay
+
+
+def _before_retry(exc, policy: RetryPolicy, attempt: int, provider: str) -> float:
+    delay = retry_delay(exc, policy, attempt)
+    response = _response(exc)
+    if response is not None and (response.status_code == 429 or "Retry-After" in response.headers):
+        # The provider asked us to slow down: hold back every session, not just this call
+        call_scheduler.backoff(provider, delay)
+    return delay
+
+
+def call(fn, policy: RetryPolicy, provider: str = "replicate"):
+    """Call fn() and retry transient failures per policy; the last error is re-raised."""
+    for attempt in range(policy.attempts):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == policy.attempts - 1 or not should_retry(e, policy):
+                raise
+            time.sleep(_before_retry(e, policy, attempt, provider))
+
+
+async def call_async(fn, policy: RetryPolicy, provider: str = "replicate"):
+    """call() for coroutine functions: await fn() with the same retry rules."""
+    for attempt in range(policy.attempts):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt == policy.attempts - 1 or not should_retry(e, policy):
+                raise
+            await asyncio.sleep(_before_retry(e, policy, attempt, provider))
+
+
+def record_download(seconds: float):
+    with _lock:
+        _download_times.append(seconds)
+
+
+def hedge_delay():
+    """Seconds after which a download gets a hedged twin (observed p95), or None."""
+    if not HEDGE_DOWNLOADS:
+        return None
+    with _lock:
+        times = sorted(_download_times)
+    if len(times) < HEDGE_MIN_SAMPLES:
+        return None
+    return times[min(len(times) - 1, int(len(times) * HEDGE_PERCENTILE))]
+
+
+def _timed(fetch, stop):
+    started = time.monotonic()
+    result = fetch(stop)
+    record_download(time.monotonic() - started)
+    return result
+
+
+def hedged(fetch):
+    """
+    Run fetch(stop), an idempotent download returning bytes that gives up
+    once the `stop` Event is set, on the calling thread. If it is still
+    running after the p95 download time, a second fetch starts on the hedge
+    pool and whichever succeeds first wins; the other one is stopped. (A
+    primary stuck without data only notices at its next chunk or read
+    timeout.)
+    """
+    delay = hedge_delay()
+    if delay is None:
+        return _timed(fetch, None)
+
+    primary_stop = threading.Event()
+    twin_stop = threading.Event()
+    twin = []
+
+    def on_twin_done(future):
+        if future.exception() is None:
+            primary_stop.set()
+
+    def launch():
+        future = _hedge_executor.submit(_timed, fetch, twin_stop)
+        twin.append(future)
+        future.add_done_callback(on_twin_done)
+
+    # The pool is only used for the twin, so the primary never queues behind other downloads
+    timer = threading.Timer(delay, launch)
+    timer.daemon = True
+    timer.start()
+    try:
+        result = _timed(fetch, primary_stop)
+    except Exception:
+        timer.cancel()
+        timer.join()  # launch() has either run or never will
+        if not twin:
+            raise
+        # The twin won (and stopped us) or is the last chance
+        return twin[0].result()
+    timer.cancel()
+    timer.join()
+    twin_stop.set()
+    return result
+
+
+async def _timed_async(fetch):
+    started = time.monotonic()
+    result = await fetch()
+    record_download(time.monotonic() - started)
+    return result
+
+
+async def hedged_async(fetch):
+    """hedged() for a coroutine function; the losing request is cancelled."""
+    delay = hedge_delay()
+    if delay is None:
+        return await _timed_async(fetch)
+
+    pending = {asyncio.ensure_future(_timed_async(fetch))}
+    done, pending = await asyncio.wait(pending, timeout=delay)
+    if not done:
+        pending.add(asyncio.ensure_future(_timed_async(fetch)))
+
+    error = None
+    try:
+        while done or pending:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
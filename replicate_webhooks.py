@@ -0,0 +1,254 @@
+# replicate_webhooks.py
+#
+# Optional webhook mode for Replicate predictions. A small HTTP receiver runs
+# in a daemon thread inside the Streamlit process; predictions are created
+# with a `webhook` URL pointing at it, and the waiting session blocks on a
+# Future keyed by prediction id instead of sending status GETs.
+#
+# Run `python replicate_webhooks.py` to exercise the receiver offline against
+# the local stand-in sender (no Replicate account or network needed).
+
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WEBHOOK_PATH = "/replicate-webhook"
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+# Results that arrive before anyone waits for them are kept this long, and
+# at most this many of them
+UNCLAIMED_TTL = 600
+MAX_UNCLAIMED = 1000
+# Reject signed deliveries whose timestamp is further off than this (seconds)
+SIGNATURE_TOLERANCE = 300
+# Largest delivery body read into memory (a prediction JSON is a few KB)
+MAX_BODY_BYTES = 1024 * 1024
+# While waiting, check the caller's `cancelled` callback this often (seconds)
+CANCEL_CHECK_INTERVAL = 1.0
+
+
+def sign_payload(secret: str, webhook_id: str, timestamp: str, body: bytes) -> str:
+    """Compute a Replicate-style `webhook-signature` value for a body."""
+    key = base64.b64decode(secret.split("_", 1)[1] if secret.startswith("whsec_") else secret)
+    signed = f"{webhook_id}.{timestamp}.".encode() + body
+    digest = hmac.new(key, signed, hashlib.sha256).digest()
+    return "v1," + base64.b64encode(digest).decode()
+
+
+def verify_signature(secret: str, headers, body: bytes) -> bool:
+    """Check the webhook-id/-timestamp/-signature headers against the shared secret."""
+    webhook_id = headers.get("webhook-id")
+    timestamp = headers.get("webhook-timestamp")
+    signatures = headers.get("webhook-signature")
+    if not (webhook_id and timestamp and signatures):
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > SIGNATURE_TOLERANCE:
+            return False
+    except ValueError:
+        return False
+    expected = sign_payload(secret, webhook_id, timestamp, body)
+    return any(hmac.compare_digest(expected, sig) for sig in signatures.split())
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    receiver = None  # set on the per-receiver subclass
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0] != WEBHOOK_PATH:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        # The endpoint is public: bound what an unsigned request can make us read
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._reject(400)
+            return
+        if length > MAX_BODY_BYTES:
+            self._reject(413)
+            return
+        body = self.rfile.read(length)
+
+        if not verify_signature(self.receiver.secret, self.headers, body):
+            self.send_response(401)
+            self.end_headers()
+            return
+
+        try:
+            prediction = json.loads(body)
+            self.receiver.deliver(prediction)
+        except (ValueError, KeyError, TypeError):
+            self.send_response(400)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.end_headers()
+
+    def _reject(self, status: int):
+        self.send_response(status)
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        # Keep Streamlit's console free of per-request access logs
+        pass
+
+
+class WebhookReceiver:
+    """
+    Local HTTP endpoint that resolves per-prediction Futures. It has to be
+    publicly reachable, so a signing secret is mandatory: unsigned or
+    mis-signed deliveries are rejected.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 8765, secret: str = None, public_url: str = None):
+        if not secret:
+            raise ValueError("A webhook signing secret is required to run the receiver.")
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self.public_url = public_url
+        self._server = None
+        self._thread = None
+        self._pending = {}  # prediction id -> (Future, registered_at)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """URL to hand to Replicate as the prediction's `webhook`."""
+        if self.public_url:
+            return self.public_url
+        host = "127.0.0.1" if self.host in ("0.0.0.0", "") else self.host
+        return f"http://{host}:{self.port}{WEBHOOK_PATH}"
+
+    def start(self):
+        handler = type("BoundWebhookHandler", (_WebhookHandler,), {"receiver": self})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="replicate-webhooks", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _entry(self, prediction_id: str) -> Future:
+        with self._lock:
+            if prediction_id not in self._pending:
+                self._pending[prediction_id] = (Future(), time.monotonic())
+            return self._pending[prediction_id][0]
+
+    def expect(self, prediction_id: str) -> Future:
+        """Future that resolves with the final prediction JSON."""
+        return self._entry(prediction_id)
+
+    def deliver(self, prediction: dict):
+        """Resolve the waiter for a prediction once it reaches a terminal status."""
+        if prediction.get("status") not in TERMINAL_STATUSES:
+            return
+        self._prune()
+        with self._lock:
+            if prediction["id"] not in self._pending and len(self._pending) >= MAX_UNCLAIMED:
+                return
+        future = self._entry(prediction["id"])
+        if not future.done():
+            future.set_result(prediction)
+
+    def forget(self, prediction_id: str):
+        with self._lock:
+            self._pending.pop(prediction_id, None)
+
+    def wait(self, prediction_id: str, timeout: float, cancelled=None) -> dict:
+        """
+        Block until the webhook for this prediction arrives; raises TimeoutError.
+        `cancelled()` is checked every CANCEL_CHECK_INTERVAL seconds and stops
+        the wait with an Exception once it returns True.
+        """
+        future = self.expect(prediction_id)
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                if cancelled and cancelled():
+                    raise Exception("Generation was cancelled")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No webhook for prediction {prediction_id}")
+                try:
+                    return future.result(timeout=min(CANCEL_CHECK_INTERVAL, remaining))
+                except FutureTimeoutError:
+                    continue
+        finally:
+            self.forget(prediction_id)
+
+    def _prune(self):
+        cutoff = time.monotonic() - UNCLAIMED_TTL
+        with self._lock:
+            stale = [pid for pid, (_, at) in self._pending.items() if at < cutoff]
+            for pid in stale:
+                del self._pending[pid]
+
+
+_receiver = None
+_receiver_lock = threading.Lock()
+
+
+def get_receiver(port: int = 8765, secret: str = None, public_url: str = None) -> WebhookReceiver:
+    """Start the process-wide receiver on first use and return it."""
+    global _receiver
+    if _receiver is None:
+        with _receiver_lock:
+            if _receiver is None:
+                _receiver = WebhookReceiver(port=port, secret=secret, public_url=public_url).start()
+    return _receiver
+
+
+# ---- Local stand-in for Replicate's webhook sender ----
+
+def send_test_webhook(url: str, prediction: dict, secret: str = None) -> int:
+    """POST a prediction to a receiver the way Replicate would; returns the HTTP status."""
+    body = json.dumps(prediction).encode()
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        webhook_id = f"msg_{prediction['id']}"
+        timestamp = str(int(time.time()))
+        headers.update({
+            "webhook-id": webhook_id,
+            "webhook-timestamp": timestamp,
+            "webhook-signature": sign_payload(secret, webhook_id, timestamp, body),
+        })
+    req = urllib.request.Request(url, data=body, headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+if __name__ == "__main__":
+    secret = "whsec_" + base64.b64encode(b"local-test-secret").decode()
+    receiver = WebhookReceiver(host="127.0.0.1", port=0, secret=secret).start()
+    fake = {"id": "local-test", "status": "succeeded", "output": ["https://example.invalid/out.png"]}
+
+    waiter = receiver.expect(fake["id"])
+    threading.Timer(0.2, send_test_webhook, args=(receiver.url, fake, secret)).start()
+    print("delivered:", waiter.result(timeout=5))
+    print("unsigned delivery rejected with:", send_test_webhook(receiver.url, fake))
+    receiver.stop()
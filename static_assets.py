@@ -0,0 +1,135 @@
+# static_assets.py
+#
+# Logo/banner images inlined into the page HTML. Each asset goes through a
+# small pipeline: resize to the width it is displayed at (times DISPLAY_SCALE
+# for HiDPI screens), re-encode as optimised PNG and as WebP, and keep
+# whichever is smaller. Results are written to ASSET_CACHE_DIR under a hash of
+# the source bytes and render settings, so they are built once per host (on
+# first run, or ahead of time with `python static_assets.py`) and survive
+# restarts. The data: URI built from a cached file is held per process via
+# st.cache_resource instead of being re-encoded on every rerun; the source
+# mtime is part of that key, so replacing an asset on disk is picked up
+# without a restart.
+
+import base64
+import hashlib
+import io
+import os
+import tempfile
+
+import streamlit as st
+from PIL import Image
+
+ASSET_CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", ".asset_cache")
+
+# Pixels per CSS pixel, so shrunk assets stay sharp on HiDPI screens
+DISPLAY_SCALE = 2
+
+# Bump when the render settings below change, to invalidate cached outputs
+PIPELINE_VERSION = 1
+WEBP_QUALITY = 90
+
+# Assets the app inlines, with the CSS width they are shown at
+ASSETS = {
+    "gms_logo.png": 250,
+    "magic.png": 100,
+}
+
+MIME_TYPES = {"png": "image/png", "webp": "image/webp"}
+
+
+def _resize(img, width: int):
+    if not width or img.width <= width:
+        return img
+    height = max(1, round(img.height * width / img.width))
+    return img.resize((width, height), Image.LANCZOS)
+
+
+def _encode_candidates(img) -> dict:
+    """Optimised PNG and WebP encodings of an image, keyed by format."""
+    png = io.BytesIO()
+    img.save(png, format="PNG", optimize=True)
+    webp = io.BytesIO()
+    # Logos need a clean alpha edge; lossless is usually smallest at these sizes
+    img.save(webp, format="WEBP", lossless=img.mode in ("RGBA", "LA", "P"), quality=WEBP_QUALITY, method=6)
+    return {"png": png.getvalue(), "webp": webp.getvalue()}
+
+
+def _cache_key(source: bytes, width: int) -> str:
+    h = hashlib.sha256(source)
+    h.update(f"|{width}|{DISPLAY_SCALE}|{PIPELINE_VERSION}".encode())
+    return h.hexdigest()[:32]
+
+
+def _cached_path(key: str):
+    for fmt in MIME_TYPES:
+        path = os.path.join(ASSET_CACHE_DIR, f"{key}.{fmt}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def build_asset(path: str, display_width: int = None):
+    """
+    Return (cached_path, format) for the processed version of an asset,
+    building it on first use. Falls back to the original file if the cache
+    directory is not writable.
+    """
+    with open(path, "rb") as f:
+        source = f.read()
+    key = _cache_key(source, display_width or 0)
+    cached = _cached_path(key)
+    if cached:
+        return cached, cached.rsplit(".", 1)[1]
+
+    with Image.open(io.BytesIO(source)) as img:
+        img.load()
+        resized = _resize(img, (display_width or 0) * DISPLAY_SCALE)
+        fmt, data = min(_encode_candidates(resized).items(), key=lambda item: len(item[1]))
+
+    cached = os.path.join(ASSET_CACHE_DIR, f"{key}.{fmt}")
+    try:
+        _write_atomic(cached, data)
+    except OSError:
+        return path, "png"
+    return cached, fmt
+
+
+@st.cache_resource(show_spinner=False)
+def _encoded_asset(path: str, display_width: int, mtime: float) -> str:
+    cached, fmt = build_asset(path, display_width)
+    with open(cached, "rb") as f:
+        data = f.read()
+    return f"data:{MIME_TYPES[fmt]};base64," + base64.b64encode(data).decode()
+
+
+def image_data_uri(path: str, display_width: int = None):
+    """data: URI for an asset sized for `display_width` CSS px, or None if the file is missing."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    return _encoded_asset(path, display_width, mtime)
+
+
+if __name__ == "__main__":
+    # Build step: pre-render every known asset so the first page load is cheap
+    for name, width in ASSETS.items():
+        if not os.path.exists(name):
+            print(f"{name}: missing, skipped")
+            continue
+        cached, fmt = build_asset(name, width)
+        print(f"{name}: {os.path.getsize(name)} B -> {cached} ({os.path.getsize(cached)} B, {fmt})")
@@ -1,50 +1,29 @@
 import streamlit as st
-import openai
 import json
-import re
+
+import json_parsing
+import prompt_cache_metrics
+from openai_client import get_openai_client
 
 def extract_first_json(text):
     """
-    Improved JSON extraction with better error handling
+    Return the JSON object in a model reply (first element if the whole reply
+    is an array), skipping any prose or code fences around it. Uses a linear
+    scanner instead of a regex, so brace-heavy text cannot make it backtrack.
     """
-    text = text.strip()
-    
-    # Handle array format
-    if text.startswith("["):
-        try:
-            arr = json.loads(text)
-            return arr[0] if arr else {}
-        except json.JSONDecodeError as e:
-            st.error(f"JSON Array Parse Error: {e}")
-            return create_fallback_response()
-    
-    # Handle single object format
-    if text.startswith("{"):
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError as e:
-            st.error(f"JSON Object Parse Error: {e}")
-            return create_fallback_response()
-    
-    # Try to extract JSON from mixed content
     try:
-        # Look for JSON objects in the text
-        json_pattern = r'\{(?:[^{}]|{[^{}]*})*\}'
-        matches = re.findall(json_pattern, text, re.DOTALL)
-        
-        for match in matches:
-            try:
-                return json.loads(match)
-            except json.JSONDecodeError:
-                continue
-        
-        # If no valid JSON found, return fallback
-        return create_fallback_response()
-        
-    except Exception as e:
+        value, _, _ = json_parsing.scan_first_json(text)
+    except json_parsing.JSONScanError as e:
         st.error(f"JSON Extraction Error: {e}")
         return create_fallback_response()
 
+    if isinstance(value, list):
+        value = value[0] if value else {}
+    if not isinstance(value, dict):
+        st.error(f"JSON Extraction Error: expected an object, got {type(value).__name__}")
+        return create_fallback_response()
+    return value
+
 def create_fallback_response():
     """
     Create a safe fallback response when JSON parsing fails
@@ -277,8 +256,7 @@ if "selected_variant" not in st.session_state:
 
 # ---- GENERATE CONTENT: starts a NEW session ----
 if generate_btn and prompt:
-    openai_api_key = st.secrets["OPENAI_API_KEY"]
-    client = openai.OpenAI(api_key=openai_api_key)
+    client = get_openai_client()
 
     # Reset chat history to only system prompt (new session)
     st.session_state.chat_history = [{"role": "system", "content": system_prompt}]
@@ -304,11 +282,12 @@ if generate_btn and prompt:
     try:
         response = client.chat.completions.create(
             model="gpt-4o-mini",
-            messages=st.session_state.chat_history,
+            messages=prompt_cache_metrics.build_messages(system_prompt, st.session_state.chat_history),
             max_tokens=2000,
             temperature=0.7,
             n=int(variants)
         )
+        prompt_cache_metrics.record_usage(response.usage, "generate")
         
         # Collect variants with robust JSON extraction
         variant_list = []
@@ -404,8 +383,7 @@ if st.session_state.last_output:
 
     # ---- EDIT CONTENT: continue the existing session ----
     if edit_btn and follow_up:
-        openai_api_key = st.secrets["OPENAI_API_KEY"]
-        client = openai.OpenAI(api_key=openai_api_key)
+        client = get_openai_client()
 
         try:
             # Get JSON-encoded user message and previous assistant message from chat_history
@@ -424,10 +402,11 @@ if st.session_state.last_output:
 
             response = client.chat.completions.create(
                 model="gpt-4o-mini",
-                messages=st.session_state.chat_history,
+                messages=prompt_cache_metrics.build_messages(system_prompt, st.session_state.chat_history),
                 max_tokens=2000,
                 temperature=0.7,
             )
+            prompt_cache_metrics.record_usage(response.usage, "edit")
             
             output_text = response.choices[0].message.content
             
@@ -464,6 +443,9 @@ if st.session_state.last_output:
             # Show more detailed error information
             st.error(f"Error details: {str(e)}")
 
+# ---- Prompt cache metrics ----
+prompt_cache_metrics.render_panel()
+
 # ---- Always display RAW INPUT and RAW OUTPUT text areas ----
 # Commented out for cleaner UI - uncomment for debugging
 # st.markdown("#### RAW INPUT (API Request Messages)")